@@ -17,11 +17,11 @@ login_manager = LoginManager()
 
 
 def create_app(config_name=None):
-    log.info(f"Create app (config_name: {config_name})")
+    log.info("Create app (config_name: %s)", config_name)
     if os.getenv("FLASK_CONFIG") == "production":
         log.info("Executing in PRODUCTION")
         app = Flask(__name__)
-        log.info(f"Get configs from {os.getenv('FLASK_CONFIG')}")
+        log.info("Get configs from %s", os.getenv("FLASK_CONFIG"))
         app.config.update(
             SECRET_KEY=os.getenv("SECRET_KEY"),
             SQLALCHEMY_DATABASE_URI=os.getenv("SQLALCHEMY_DATABASE_URI"),
@@ -46,7 +46,7 @@ def create_app(config_name=None):
             SECRET_KEY="$dev_or_test$",
             DATABASE=os.path.join(app.instance_path, "flaskr.sqlite"),
         )
-        log.info(f"Get configs from {os.getenv('FLASK_CONFIG')}")
+        log.info("Get configs from %s", os.getenv("FLASK_CONFIG"))
         app.config.from_pyfile("config.py")
 
     # ensure the instance folder exists
@@ -54,9 +54,11 @@ def create_app(config_name=None):
         log.info("Create instance folder")
         os.makedirs(app.instance_path)
     except OSError as e:
-        log.error(f"Error: {e}")
+        log.error("Error: %s", e)
         pass
 
+    Log.set_levels(app.config.get("LOG_LEVELS", {}))
+
     log.info("Initialize the application for the use with its setup DB")
     db.init_app(app)
 
@@ -77,6 +79,15 @@ def create_app(config_name=None):
 
     app.register_blueprint(user_blueprint)
 
+    from .commands import import_didnumbers_command, recount_didnumbers_command
+    from . import metrics
+
+    app.cli.add_command(import_didnumbers_command)
+    app.cli.add_command(recount_didnumbers_command)
+
+    # Requests
+    metrics.init_app(app)
+
     # Errors
     @app.errorhandler(400)
     def bad_request(e):
@@ -109,4 +120,9 @@ def create_app(config_name=None):
         log.error(e)
         return jsonify(error=str(e)), 500
 
+    @app.errorhandler(503)
+    def service_unavailable(e):
+        log.error(e)
+        return jsonify(error=str(e)), 503
+
     return app
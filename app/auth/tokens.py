@@ -0,0 +1,59 @@
+from flask import abort, current_app, g
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+from log import Log
+from .. import login_manager
+from ..models import EmployeeSnapshot
+
+log = Log("evolux-project").get_logger(logger_name="auth-tokens")
+
+
+def get_serializer(kind: str) -> URLSafeTimedSerializer:
+    """
+    Get the serializer that signs the access or refresh tokens with the application secret key
+    """
+
+    return URLSafeTimedSerializer(current_app.config["SECRET_KEY"], salt=f"evolux-{kind}-token")
+
+
+def issue_tokens(employee) -> dict:
+    """
+    Issue a short-lived access token carrying the employee id and admin flag, and a longer-lived refresh token
+    """
+
+    claims = {"id": employee.id, "username": employee.username, "is_admin": bool(employee.is_admin)}
+    return {
+        "access_token": get_serializer("access").dumps(claims),
+        "refresh_token": get_serializer("refresh").dumps({"id": employee.id}),
+        "token_type": "Bearer",
+        "expires_in": current_app.config.get("TOKEN_ACCESS_TTL", 900),
+    }
+
+
+def load_token(kind: str, token: str) -> dict:
+    """
+    Check the signature and the expiry of a token and return its claims
+    """
+
+    max_age = current_app.config.get(f"TOKEN_{kind.upper()}_TTL", 900 if kind == "access" else 86400)
+    try:
+        return get_serializer(kind).loads(token, max_age=max_age)
+    except SignatureExpired:
+        abort(401, f"The {kind} token has expired.")
+    except BadSignature:
+        abort(401, f"Invalid {kind} token.")
+
+
+@login_manager.request_loader
+def load_user_from_token(request):
+    """
+    Authenticate a request with an `Authorization: Bearer <access token>` header, without touching the database
+    """
+
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+
+    claims = load_token("access", token.strip())
+    g.employee_id = claims["id"]
+    return EmployeeSnapshot(claims["id"], claims["username"], claims["is_admin"])
@@ -1,10 +1,14 @@
-from flask import abort, jsonify, request
+from flask import abort, current_app, jsonify, request
 from flask_login import login_required, login_user, logout_user
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
 
 from log import Log
 from . import auth
-from .. import db
+from .tokens import issue_tokens, load_token
+from .. import db, hashing
 from ..models import Employee, employee_schema
+from ..user.views import check_admin
 
 log = Log("evolux-project").get_logger(logger_name="auth-views")
 
@@ -25,22 +29,22 @@ def signup():
         password = request.json["password"]
         is_admin = request.json["is_admin"]
     except KeyError as e:
-        log.error(f"KeyError: {e}")
+        log.error("KeyError: %s", e)
         abort(400, f"There is no key with that value: {e}")
 
     if Employee.query.filter_by(email=email).first():
-        log.error(f"{email} is already in use.")
+        log.error("%s is already in use.", email)
         abort(403, description=f"{email} is already in use.")
 
     if Employee.query.filter_by(username=username).first():
-        log.error(f"{username} is already in use.")
+        log.error("%s is already in use.", username)
         abort(403, description=f"{username} is already in use.")
 
     employee = Employee(
         email=email, username=username, first_name=first_name, last_name=last_name, password=password, is_admin=is_admin
     )
 
-    log.info(f'Add "{employee}" to database')
+    log.info('Add "%s" to database', employee)
     db.session.add(employee)
     db.session.commit()
 
@@ -48,6 +52,99 @@ def signup():
     return jsonify(result), 201
 
 
+@auth.route("/signup/bulk", methods=["POST"])
+@login_required
+def bulk_signup():
+    """
+    Handle requests to the /signup/bulk route. Here an admin adds many employees at once, in a single transaction
+    """
+
+    check_admin()
+
+    employees = request.get_json(silent=True)
+    if isinstance(employees, dict):
+        employees = employees.get("employees")
+    if not isinstance(employees, list):
+        abort(400, "Expected an array of employees")
+
+    max_items = current_app.config.get("EMPLOYEES_BULK_MAX_ITEMS", 1000)
+    if len(employees) > max_items:
+        abort(400, f"At most {max_items} employees can be added at once")
+
+    log.info("Set employee variables from request")
+    results, valid, emails, usernames = [], [], set(), set()
+    for index, data in enumerate(employees):
+        result = {"index": index, "status": "error"}
+        results.append(result)
+        keys = ("email", "username", "first_name", "last_name", "password")
+        missing = [key for key in keys if not isinstance(data, dict) or not data.get(key)]
+        if missing:
+            result["error"] = f"There is no key with that value: '{missing[0]}'"
+            continue
+
+        invalid = [key for key in keys if not isinstance(data[key], str)]
+        if invalid:
+            result["error"] = f"The value of '{invalid[0]}' must be a text."
+            continue
+
+        too_long = [key for key in ("email", "username", "first_name", "last_name") if len(data[key]) > 60]
+        if too_long:
+            result["error"] = f"The value of '{too_long[0]}' must be at most 60 characters long."
+            continue
+
+        if not isinstance(data.get("is_admin", False), bool):
+            result["error"] = "The value of 'is_admin' must be true or false."
+            continue
+
+        result.update(email=data["email"], username=data["username"])
+        if data["email"] in emails or data["username"] in usernames:
+            result["error"] = "The email or username is duplicated in the request."
+            continue
+
+        emails.add(data["email"])
+        usernames.add(data["username"])
+        valid.append((result, data))
+
+    log.info("Check which emails and usernames are already in use")
+    in_use = Employee.query.with_entities(Employee.email, Employee.username)
+    in_use = in_use.filter(or_(Employee.email.in_(emails), Employee.username.in_(usernames))).all() if valid else []
+    used_emails, used_usernames = {email for email, _ in in_use}, {username for _, username in in_use}
+    for result, data in valid:
+        if data["email"] in used_emails:
+            result["error"] = f"{data['email']} is already in use."
+        elif data["username"] in used_usernames:
+            result["error"] = f"{data['username']} is already in use."
+    valid = [(result, data) for result, data in valid if "error" not in result]
+
+    log.info("Hash %s passwords", len(valid))
+    password_hashes = hashing.hash_passwords([data["password"] for _, data in valid])
+    new_employees = [
+        Employee(
+            email=data["email"],
+            username=data["username"],
+            first_name=data["first_name"],
+            last_name=data["last_name"],
+            is_admin=data.get("is_admin", False),
+            password_hash=password_hash,
+        )
+        for (_, data), password_hash in zip(valid, password_hashes)
+    ]
+
+    try:
+        log.info("Add %s employees to database", len(new_employees))
+        db.session.add_all(new_employees)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        abort(403, description="Some emails or usernames were taken meanwhile, please try again.")
+
+    for (result, _), employee in zip(valid, new_employees):
+        result.update(status="created", id=employee.id)
+
+    created = sum(1 for result in results if result["status"] == "created")
+    return jsonify({"created": created, "error": len(results) - created, "results": results}), 200
+
+
 @auth.route("/login", methods=["GET", "POST"])
 def login():
     """
@@ -61,18 +158,24 @@ def login():
             email = request.json["email"]
             password = request.json["password"]
         except KeyError as e:
-            log.error(f"KeyError: {e}")
+            log.error("KeyError: %s", e)
             abort(400, f"There is no key with that value: {e}")
 
         # Check if the user exists in the database and if the password entered matches the password in the database
-        log.info(f"Check DB for {email}")
+        log.info("Check DB for %s", email)
         employee = Employee.query.filter_by(email=email).first()
         result = ""
         if employee is not None and employee.check_password(password):
-            log.info(f"{employee.username} found. Logging in")
+            log.info("%s found. Logging in", employee.username)
+            if employee.rehash_password(password):
+                db.session.commit()
             result = employee_schema.dump(employee)
-            # log user in
-            login_user(employee)
+            if request.json.get("token") or request.args.get("token"):
+                # stateless mode: signed tokens instead of a session cookie
+                result.update(issue_tokens(employee))
+            else:
+                # log user in
+                login_user(employee)
         else:
             abort(401, "Invalid email or password.")
 
@@ -90,3 +193,26 @@ def logout():
 
     logout_user()
     return jsonify({"message": "You have successfully been logged out."}), 200
+
+
+@auth.route("/token/refresh", methods=["POST"])
+def refresh_token():
+    """
+    Handle requests to the /token/refresh route. Exchange a refresh token for new access and refresh tokens
+    """
+
+    log.info("Set refresh token from request")
+    token = ""
+    try:
+        token = request.json["refresh_token"]
+    except (KeyError, TypeError) as e:
+        log.error("KeyError: %s", e)
+        abort(400, f"There is no key with that value: {e}")
+
+    claims = load_token("refresh", token)
+    employee = Employee.query.get(claims["id"])
+    if employee is None:
+        abort(401, "Invalid refresh token.")
+
+    log.info("Refresh the tokens of %s", employee.username)
+    return jsonify(issue_tokens(employee)), 200
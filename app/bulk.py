@@ -0,0 +1,367 @@
+import csv
+import io
+import json
+import os
+import re
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import bindparam, case, func
+from sqlalchemy.exc import IntegrityError
+
+from log import Log
+from . import db
+from .events import did_numbers_changed
+from .models import DidNumber, DidNumberCount, get_value_digits
+
+log = Log("evolux-project").get_logger(logger_name="bulk")
+
+FILE_FORMATS = ("csv", "ndjson")
+BATCH_MODES = ("insert", "upsert", "skip-existing")
+PRICE_CHANGE = re.compile(r"^([+-])(\d+(?:\.\d+)?)(%?)$")
+
+
+def chunked(items, size: int):
+    """
+    Split a list into lists of at most `size` items
+    """
+
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def validate_did_number(data):
+    """
+    Check a DID number payload (API or snake_case keys) and return the row to insert and an error message
+    """
+
+    if not isinstance(data, dict):
+        return None, "Expected an object with value, monthlyPrice, setupPrice and currency"
+
+    row = {}
+    for key, alias, name in (
+        ("value", "value", "value"),
+        ("monthlyPrice", "monthly_price", "monthly_price"),
+        ("setupPrice", "setup_price", "setup_price"),
+        ("currency", "currency", "currency"),
+    ):
+        if data.get(key) is None and data.get(alias) is None:
+            return None, f"There is no key with that value: '{key}'"
+        row[name] = data[key] if data.get(key) is not None else data[alias]
+
+    if not isinstance(row["value"], str) or not row["value"].strip() or len(row["value"].strip()) > 17:
+        return None, f"Invalid DID number value: {row['value']}"
+    row["value"] = row["value"].strip()
+
+    for name in ("monthly_price", "setup_price"):
+        try:
+            row[name] = float(row[name])
+        except (TypeError, ValueError):
+            return None, f"Invalid {name}: {row[name]}"
+        if row[name] < 0:
+            return None, f"Invalid {name}: {row[name]}"
+
+    if not isinstance(row["currency"], str) or not 0 < len(row["currency"].strip()) <= 3:
+        return None, f"Invalid currency: {row['currency']}"
+    row["currency"] = row["currency"].strip()
+
+    return row, None
+
+
+def find_existing_values(values) -> dict:
+    """
+    Map which of the given DID number values are already in the database (by their digits, so any formatting of the
+    same number matches) to their ids, using chunked `IN` queries
+    """
+
+    values_by_digits = {}
+    for value in values:
+        values_by_digits.setdefault(get_value_digits(value), []).append(value)
+    values_by_digits.pop(None, None)
+
+    existing = {}
+    for chunk in chunked(list(values_by_digits), current_app.config.get("DIDNUMBERS_IN_CHUNK_SIZE", 500)):
+        query = db.session.query(DidNumber.digits, DidNumber.id).filter(DidNumber.digits.in_(chunk))
+        for digits, id in query:
+            existing.update((value, id) for value in values_by_digits[digits])
+
+    return existing
+
+
+def count_by_currency(ids) -> Counter:
+    """
+    Count the DID numbers with the given ids per currency
+    """
+
+    query = db.session.query(DidNumber.currency, func.count(DidNumber.id)).filter(DidNumber.id.in_(ids))
+    return Counter(dict(query.group_by(DidNumber.currency)))
+
+
+def parse_did_numbers(stream, file_format: str):
+    """
+    Read a CSV or NDJSON binary stream lazily and yield (line number, payload, error) for each record
+    """
+
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if file_format == "csv":
+        reader = csv.DictReader(text)
+        for data in reader:
+            yield reader.line_num, data, None
+    else:
+        for line_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line), None
+            except ValueError as e:
+                yield line_number, None, f"Invalid JSON: {e}"
+
+
+def insert_did_numbers(batch, report: dict):
+    """
+    Insert a batch of (line number, row) in a single transaction, reporting rows whose value already exists
+    """
+
+    existing = find_existing_values(row["value"] for _, row in batch)
+    accepted, seen = [], set()
+    for line_number, row in batch:
+        key = get_value_digits(row["value"]) or row["value"]
+        if row["value"] in existing or key in seen:
+            add_error(report, line_number, row["value"], f"DID Number value {row['value']} already exists.")
+        else:
+            seen.add(key)
+            accepted.append((line_number, row))
+
+    if not accepted:
+        return
+
+    try:
+        db.session.execute(DidNumber.__table__.insert(), [row for _, row in accepted])
+        DidNumberCount.adjust(Counter(row["currency"] for _, row in accepted))
+        db.session.commit()
+        report["inserted"] += len(accepted)
+        did_numbers_changed()
+    except IntegrityError:
+        # Another writer inserted one of the values meanwhile: fall back to row by row for this batch
+        db.session.rollback()
+        log.warning("Batch insert failed, inserting the rows one by one")
+        for line_number, row in accepted:
+            try:
+                db.session.execute(DidNumber.__table__.insert(), row)
+                DidNumberCount.adjust({row["currency"]: 1})
+                db.session.commit()
+                report["inserted"] += 1
+            except IntegrityError:
+                db.session.rollback()
+                add_error(report, line_number, row["value"], f"DID Number value {row['value']} already exists.")
+        did_numbers_changed()
+
+
+def add_error(report: dict, line_number: int, value, message: str):
+    """
+    Record an error in an import report, keeping at most DIDNUMBERS_IMPORT_MAX_ERRORS of them
+    """
+
+    report["error_count"] += 1
+    if len(report["errors"]) < current_app.config.get("DIDNUMBERS_IMPORT_MAX_ERRORS", 1000):
+        report["errors"].append({"line": line_number, "value": value, "error": message})
+
+
+def import_did_numbers(stream, file_format: str, progress=None) -> dict:
+    """
+    Import DID numbers from a CSV or NDJSON stream in batched transactions and return a report with the number
+    of inserted rows and the invalid or duplicated ones (with their line numbers)
+    """
+
+    if file_format not in FILE_FORMATS:
+        raise ValueError(f"Invalid import format: {file_format}")
+
+    batch_size = current_app.config.get("DIDNUMBERS_IMPORT_BATCH_SIZE", 5000)
+    report = {"processed": 0, "inserted": 0, "error_count": 0, "errors": []}
+    batch = []
+
+    log.info("Import DID numbers from %s", file_format)
+    for line_number, data, error in parse_did_numbers(stream, file_format):
+        report["processed"] += 1
+        row = None
+        if error is None:
+            row, error = validate_did_number(data)
+        if error is not None:
+            add_error(report, line_number, data.get("value") if isinstance(data, dict) else None, error)
+            continue
+
+        batch.append((line_number, row))
+        if len(batch) >= batch_size:
+            insert_did_numbers(batch, report)
+            batch = []
+            if progress is not None:
+                progress(report)
+
+    if batch:
+        insert_did_numbers(batch, report)
+
+    log.info("%s DID numbers imported, %s errors", report["inserted"], report["error_count"])
+    return report
+
+
+def import_did_numbers_file(path: str, file_format: str, progress=None, remove: bool = False) -> dict:
+    """
+    Import DID numbers from a file, optionally removing it afterwards (used for spooled uploads)
+    """
+
+    try:
+        with open(path, "rb") as stream:
+            return import_did_numbers(stream, file_format, progress)
+    finally:
+        if remove:
+            os.remove(path)
+
+
+def batch_did_numbers(items: list, mode: str) -> list:
+    """
+    Create (or update/skip, depending on `mode`) a list of DID number payloads with one set-based statement per
+    chunk and return a result for each item, in the request order
+    """
+
+    if mode not in BATCH_MODES:
+        raise ValueError(f"Invalid batch mode: {mode}")
+
+    results, valid, seen = [], [], set()
+    for index, data in enumerate(items):
+        row, error = validate_did_number(data)
+        value = row["value"] if row else data.get("value") if isinstance(data, dict) else None
+        results.append({"index": index, "value": value, "status": "error" if error else None, "error": error})
+        if error is not None:
+            continue
+        key = get_value_digits(row["value"]) or row["value"]
+        if key in seen:
+            results[index].update(status="error", error=f"DID Number value {row['value']} is duplicated in the batch.")
+            continue
+        seen.add(key)
+        valid.append((index, row))
+
+    log.info("Batch %s DID numbers (%s)", len(valid), mode)
+    for chunk in chunked(valid, current_app.config.get("DIDNUMBERS_BATCH_CHUNK_SIZE", 500)):
+        existing = find_existing_values(row["value"] for _, row in chunk)
+        new = [(index, row) for index, row in chunk if row["value"] not in existing]
+        old = [(index, dict(row, id=existing[row["value"]])) for index, row in chunk if row["value"] in existing]
+
+        try:
+            deltas = Counter(row["currency"] for _, row in new)
+            if new:
+                db.session.execute(DidNumber.__table__.insert(), [row for _, row in new])
+            if old and mode == "upsert":
+                deltas.update(row["currency"] for _, row in old)
+                deltas.subtract(count_by_currency([row["id"] for _, row in old]))
+                table = DidNumber.__table__
+                statement = (
+                    table.update()
+                    .where(table.c.id == bindparam("_id"))
+                    .values(
+                        monthly_price=bindparam("_monthly_price"),
+                        setup_price=bindparam("_setup_price"),
+                        currency=bindparam("_currency"),
+                    )
+                )
+                db.session.execute(statement, [{f"_{key}": value for key, value in row.items()} for _, row in old])
+            DidNumberCount.adjust(deltas)
+            created = find_existing_values(row["value"] for _, row in new) if new else {}
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            for index, row in chunk:
+                results[index].update(status="error", error="Conflicting concurrent write, please try again.")
+            continue
+
+        for index, row in new:
+            results[index].update(status="created", id=created[row["value"]])
+        for index, row in old:
+            results[index]["id"] = row["id"]
+            if mode == "upsert":
+                results[index]["status"] = "updated"
+            elif mode == "skip-existing":
+                results[index]["status"] = "skipped"
+            else:
+                results[index].update(status="error", error=f"DID Number value {row['value']} already exists.")
+
+    return results
+
+
+def get_price_change(column, change):
+    """
+    Build the SQL expression for a price change: a number sets the price, "+5%"/"-5%" changes it by a percentage
+    and "+0.5"/"-0.5" by an amount (never below zero). Return None if the change is invalid.
+    """
+
+    if isinstance(change, str):
+        match = PRICE_CHANGE.match(change.replace(" ", ""))
+        if match:
+            sign, amount, percent = match.groups()
+            amount = float(amount) if sign == "+" else -float(amount)
+            price = column * (1 + amount / 100) if percent else column + amount
+            return price if sign == "+" else case([(price < 0, 0.0)], else_=price)
+
+    if isinstance(change, bool):
+        return None
+
+    try:
+        price = float(change)
+    except (TypeError, ValueError):
+        return None
+
+    return price if 0 <= price < float("inf") else None
+
+
+def iter_id_chunks(ids_query):
+    """
+    Read the ids matched by a query in chunks of DIDNUMBERS_BULK_CHUNK_SIZE, in id order
+    """
+
+    chunk_size, last = current_app.config.get("DIDNUMBERS_BULK_CHUNK_SIZE", 1000), 0
+    while True:
+        ids = [id for id, in ids_query.filter(DidNumber.id > last).order_by(DidNumber.id.asc()).limit(chunk_size)]
+        if not ids:
+            return
+
+        yield ids
+        last = ids[-1]
+
+
+def update_did_numbers(ids_query, changes: dict) -> int:
+    """
+    Apply `changes` (column name to value or SQL expression) to every DID number matched by `ids_query`, with one
+    UPDATE and one transaction per chunk, and return the number of updated rows
+    """
+
+    updated = 0
+    for ids in iter_id_chunks(ids_query):
+        if "currency" in changes:
+            moved = count_by_currency(ids)
+            deltas = Counter({changes["currency"]: sum(moved.values())})
+            deltas.subtract(moved)
+            DidNumberCount.adjust(deltas)
+        result = db.session.execute(DidNumber.__table__.update().where(DidNumber.id.in_(ids)).values(**changes))
+        db.session.commit()
+        updated += result.rowcount
+
+    log.info("%s DID numbers updated", updated)
+    return updated
+
+
+def delete_did_numbers(ids_query) -> int:
+    """
+    Delete every DID number matched by `ids_query`, with one DELETE and one transaction per chunk, and return the
+    number of deleted rows
+    """
+
+    deleted = 0
+    for ids in iter_id_chunks(ids_query):
+        deltas = Counter()
+        deltas.subtract(count_by_currency(ids))
+        DidNumberCount.adjust(deltas)
+        result = db.session.execute(DidNumber.__table__.delete().where(DidNumber.id.in_(ids)))
+        db.session.commit()
+        deleted += result.rowcount
+
+    log.info("%s DID numbers deleted", deleted)
+    return deleted
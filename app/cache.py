@@ -0,0 +1,64 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    A thread-safe LRU cache whose entries expire `ttl` seconds after being set
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key, MISSING)
+            if item is not MISSING and item[1] > time.monotonic():
+                self.data.move_to_end(key)
+                self.hits += 1
+                return item[0]
+
+            if item is not MISSING:
+                del self.data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + self.ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self.data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+def get_cache(name: str, maxsize: int, ttl: float) -> TTLCache:
+    """
+    Get (or create) a named cache of the current application
+    """
+
+    caches = current_app.extensions.setdefault("caches", {})
+    if name not in caches:
+        caches[name] = TTLCache(maxsize, ttl)
+
+    return caches[name]
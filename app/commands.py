@@ -0,0 +1,35 @@
+import click
+from flask.cli import with_appcontext
+
+from .bulk import FILE_FORMATS, import_did_numbers_file
+from .models import DidNumberCount
+
+
+@click.command("import-didnumbers")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(FILE_FORMATS), help="Defaults to the file extension.")
+@with_appcontext
+def import_didnumbers_command(path, file_format):
+    """
+    Import DID numbers from a CSV or NDJSON file
+    """
+
+    file_format = file_format or path.rsplit(".", 1)[-1].lower()
+    if file_format not in FILE_FORMATS:
+        raise click.BadParameter(f"Invalid import format: {file_format}", param_hint="--format")
+
+    report = import_did_numbers_file(path, file_format)
+    click.echo(f"Processed {report['processed']} rows: {report['inserted']} inserted, {report['error_count']} errors")
+    for error in report["errors"]:
+        click.echo(f"Line {error['line']}: {error['error']}", err=True)
+
+
+@click.command("recount-didnumbers")
+@with_appcontext
+def recount_didnumbers_command():
+    """
+    Recompute the maintained DID numbers counters from the DID numbers table
+    """
+
+    DidNumberCount.rebuild()
+    click.echo(f"{DidNumberCount.get_total()} DID numbers counted")
@@ -0,0 +1,26 @@
+from log import Log
+
+log = Log("evolux-project").get_logger(logger_name="events")
+
+did_numbers_listeners = []
+
+
+def on_did_numbers_changed(func):
+    """
+    Register a function to be called after DID numbers are written
+    """
+
+    did_numbers_listeners.append(func)
+    return func
+
+
+def did_numbers_changed(added=None, removed=None):
+    """
+    Notify the listeners after DID numbers are committed. `added` and `removed` are lists of serialized rows (an edit
+    removes the old row and adds the new one); both are None when the changed rows are not known (bulk writes), so
+    listeners have to drop or rebuild whatever they derived from the table.
+    """
+
+    log.info("Notify that DID numbers have changed")
+    for listener in did_numbers_listeners:
+        listener(added, removed)
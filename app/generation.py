@@ -0,0 +1,104 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app
+
+from log import Log
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows, where only threads are synchronized
+    fcntl = None
+
+log = Log("evolux-project").get_logger(logger_name="generation")
+
+HEADER = struct.Struct("8s")
+SLOT = struct.Struct("=Qd")
+SLOTS = 64
+
+
+class Generations:
+    """
+    Counters bumped after every committed write to a table, so that a table name and its generation identify the
+    content of the table. They are kept in a small file mapped in memory by every worker process, so a write in one
+    worker is seen by all of them. Each table takes one of SLOTS slots by the hash of its name (a shared slot only
+    bumps both tables), and the random token written when the file is created tells apart its counters from the
+    counters of a recreated file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.started_at = datetime.utcnow()
+        size = HEADER.size + SLOT.size * SLOTS
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self.locked():
+            if os.fstat(self.fd).st_size < size:
+                log.info("Create the generations file %s", path)
+                os.ftruncate(self.fd, size)
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                os.write(self.fd, HEADER.pack(os.urandom(8)))
+            self.map = mmap.mmap(self.fd, size)
+
+        self.token = HEADER.unpack_from(self.map, 0)[0].hex()
+
+    @contextmanager
+    def locked(self):
+        """
+        Lock the file against the other processes (and the other threads of this one)
+        """
+
+        with self.lock:
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def offset(self, name: str) -> int:
+        return HEADER.size + SLOT.size * (zlib.crc32(name.encode()) % SLOTS)
+
+    def get(self, name: str) -> tuple:
+        """
+        Get the generation of a table, as a string, and when it was last bumped (or when this process started, which
+        bounds the writes it could not see)
+        """
+
+        counter, modified = SLOT.unpack_from(self.map, self.offset(name))
+        last_modified = max(datetime.utcfromtimestamp(modified), self.started_at) if modified else self.started_at
+        return f"{self.token}-{counter}", last_modified
+
+    def bump(self, name: str) -> tuple:
+        """
+        Bump the generation of a table, and get its generations before and after the bump
+        """
+
+        offset = self.offset(name)
+        with self.locked():
+            counter, _ = SLOT.unpack_from(self.map, offset)
+            SLOT.pack_into(self.map, offset, counter + 1, time.time())
+
+        return f"{self.token}-{counter}", f"{self.token}-{counter + 1}"
+
+
+def get_generations() -> Generations:
+    """
+    Get the generation counters of the current application, shared through the GENERATIONS_FILE file (in the instance
+    folder by default)
+    """
+
+    generations = current_app.extensions.get("generations")
+    if generations is None:
+        path = current_app.config.get("GENERATIONS_FILE") or os.path.join(current_app.instance_path, "generations")
+        generations = current_app.extensions.setdefault("generations", Generations(path))
+
+    return generations
@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+
+from flask import abort, current_app, has_app_context
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from log import Log
+
+log = Log("evolux-project").get_logger(logger_name="hashing")
+
+lock = threading.Lock()
+
+
+def get_setting(name: str, default):
+    return current_app.config.get(name, default) if has_app_context() else default
+
+
+def get_method() -> str:
+    """
+    Get the werkzeug hashing method, with the work factor set by PASSWORD_HASH_ITERATIONS
+    """
+
+    return f"pbkdf2:sha256:{get_setting('PASSWORD_HASH_ITERATIONS', 150000)}"
+
+
+class HashingPool:
+    """
+    A process pool running the password hashes, with at most `max_pending` hashes waiting or running. Its processes
+    are started by a fork server, since forking the application process would copy the state of its other threads.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        start_methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver") if "forkserver" in start_methods else None
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    @contextmanager
+    def slot(self):
+        """
+        Take a slot of the pool, or abort with 503 when the pool already has `max_pending` hashes in flight
+        """
+
+        if not self.slots.acquire(blocking=False):
+            log.warning("The password hashing pool is saturated")
+            abort(503, "The server is busy, please try again later.")
+
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+
+def get_pool() -> HashingPool:
+    """
+    Get the password hashing pool of the current application, (re)created on first use and whenever
+    PASSWORD_HASH_WORKERS or PASSWORD_HASH_MAX_PENDING changed
+    """
+
+    workers = get_setting("PASSWORD_HASH_WORKERS", os.cpu_count())
+    max_pending = get_setting("PASSWORD_HASH_MAX_PENDING", 64)
+    with lock:
+        pool = current_app.extensions.get("password-hashing")
+        if pool is None or (pool.workers, pool.max_pending) != (workers, max_pending):
+            if pool is not None:
+                pool.executor.shutdown(wait=False)
+            log.info("Start the password hashing pool with %s processes", workers)
+            pool = current_app.extensions["password-hashing"] = HashingPool(workers, max_pending)
+
+    return pool
+
+
+def run(func, *args):
+    """
+    Run a hashing function on the process pool of the application, or on the calling thread when
+    PASSWORD_HASH_WORKERS is 0 (or outside of an application)
+    """
+
+    if not has_app_context() or not get_setting("PASSWORD_HASH_WORKERS", os.cpu_count()):
+        return func(*args)
+
+    pool = get_pool()
+    with pool.slot():
+        return pool.executor.submit(func, *args).result()
+
+
+def hash_password(password: str) -> str:
+    return run(generate_password_hash, password, get_method())
+
+
+def hash_passwords(passwords: list) -> list:
+    """
+    Hash many passwords in parallel on the process pool. The whole batch takes a single slot of the pool.
+    """
+
+    method = get_method()
+    if not has_app_context() or not get_setting("PASSWORD_HASH_WORKERS", os.cpu_count()):
+        return [generate_password_hash(password, method) for password in passwords]
+
+    pool = get_pool()
+    with pool.slot():
+        chunksize = max(1, len(passwords) // (pool.workers * 4))
+        return list(pool.executor.map(generate_password_hash, passwords, repeat(method), chunksize=chunksize))
+
+
+def check_password(password_hash: str, password: str) -> bool:
+    return run(check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """
+    Check if a password hash was made with another method or work factor than the configured one
+    """
+
+    return password_hash.split("$", 1)[0] != get_method()
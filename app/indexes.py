@@ -0,0 +1,236 @@
+import bisect
+import heapq
+import re
+import threading
+import time
+
+
+class PrefixIndex:
+    """
+    An in-memory index of (key, id) pairs kept in a sorted list, so keys starting with a prefix are a contiguous
+    range found with a binary search, plus a dict for the exact matches used by the longest-prefix match
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.ids_by_key = {}
+        self.lock = threading.RLock()
+        self.built_at = None
+        self.generation = None
+
+    def build(self, pairs, generation: str = None):
+        """
+        Replace the content of the index with the given (key, id) pairs, read at the given generation of their table
+        """
+
+        entries = sorted((key, id) for key, id in pairs if key)
+        ids_by_key = {}
+        for key, id in entries:
+            ids_by_key.setdefault(key, []).append(id)
+
+        with self.lock:
+            self.entries, self.ids_by_key = entries, ids_by_key
+            self.built_at, self.generation = time.monotonic(), generation
+
+    def add(self, key, id):
+        if not key:
+            return
+
+        with self.lock:
+            i = bisect.bisect_left(self.entries, (key, id))
+            if i < len(self.entries) and self.entries[i] == (key, id):
+                return
+
+            self.entries.insert(i, (key, id))
+            self.ids_by_key.setdefault(key, []).append(id)
+
+    def remove(self, key, id):
+        with self.lock:
+            i = bisect.bisect_left(self.entries, (key, id))
+            if i < len(self.entries) and self.entries[i] == (key, id):
+                del self.entries[i]
+            ids = self.ids_by_key.get(key, [])
+            if id in ids:
+                ids.remove(id)
+            if not ids:
+                self.ids_by_key.pop(key, None)
+
+    def search(self, prefix, limit: int, after=None) -> list:
+        """
+        Get up to `limit` (key, id) pairs whose key starts with `prefix`, in key order, after the (key, id) `after`
+        """
+
+        with self.lock:
+            i = bisect.bisect_left(self.entries, (prefix,))
+            if after:
+                i = max(i, bisect.bisect_right(self.entries, tuple(after)))
+            result = []
+            while i < len(self.entries) and len(result) < limit and self.entries[i][0].startswith(prefix):
+                result.append(self.entries[i])
+                i += 1
+
+            return result
+
+    def longest_match(self, key):
+        """
+        Get the longest indexed key that is a prefix of `key` and its ids, checking one prefix length at a time
+        """
+
+        with self.lock:
+            for length in range(len(key), 0, -1):
+                ids = self.ids_by_key.get(key[:length])
+                if ids:
+                    return key[:length], list(ids)
+
+        return None, []
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SuggestIndex:
+    """
+    A prefix index of records searchable by several lowercase keys, which keeps the records themselves so that the
+    suggestions need no database query. It holds at most `maxsize` keys; once full it is marked incomplete and the
+    callers have to fall back to the database.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.prefixes = PrefixIndex()
+        self.records = {}
+        self.keys_by_id = {}
+        self.lock = self.prefixes.lock
+        self.complete = True
+        self.built_at = None
+
+    def build(self, entries):
+        """
+        Replace the content of the index with the given (id, keys, record) entries
+        """
+
+        with self.lock:
+            self.prefixes.build([])
+            self.records, self.keys_by_id, self.complete = {}, {}, True
+            for id, keys, record in entries:
+                self.put(id, keys, record)
+            self.built_at = time.monotonic()
+
+    def put(self, id, keys, record):
+        """
+        Add a record, or replace it if it is already in the index
+        """
+
+        keys = {key.lower() for key in keys if key}
+        with self.lock:
+            self.remove(id)
+            if len(self.prefixes) + len(keys) > self.maxsize:
+                self.complete = False
+                return
+
+            for key in keys:
+                self.prefixes.add(key, id)
+            self.records[id], self.keys_by_id[id] = record, keys
+
+    def remove(self, id):
+        with self.lock:
+            for key in self.keys_by_id.pop(id, ()):
+                self.prefixes.remove(key, id)
+            self.records.pop(id, None)
+
+    def suggest(self, prefix: str, k: int) -> list:
+        """
+        Get up to `k` records with a key starting with `prefix`, in key order
+        """
+
+        with self.lock:
+            ids, after = [], None
+            while len(ids) < k:
+                entries = self.prefixes.search(prefix.lower(), k, after=after)
+                ids.extend(id for _, id in entries if id not in ids)
+                if len(entries) < k:
+                    break
+                after = entries[-1]
+
+            return [self.records[id] for id in ids[:k]]
+
+
+class NGramIndex:
+    """
+    An in-memory inverted index from the n-grams of keys to the ids holding them. The n-grams of a pattern narrow the
+    candidates to the ids holding all of them, which are then checked against the pattern itself.
+    """
+
+    def __init__(self, n: int = 3):
+        self.n = n
+        self.postings = {}
+        self.keys = {}
+        self.lock = threading.RLock()
+        self.built_at = None
+        self.generation = None
+
+    def grams(self, key) -> set:
+        return {key[i : i + self.n] for i in range(len(key) - self.n + 1)}
+
+    def build(self, pairs, generation: str = None):
+        """
+        Replace the content of the index with the given (key, id) pairs, read at the given generation of their table
+        """
+
+        postings, keys = {}, {}
+        for key, id in pairs:
+            if not key:
+                continue
+            keys[id] = key
+            for gram in self.grams(key):
+                postings.setdefault(gram, set()).add(id)
+
+        with self.lock:
+            self.postings, self.keys = postings, keys
+            self.built_at, self.generation = time.monotonic(), generation
+
+    def add(self, key, id):
+        if not key:
+            return
+
+        with self.lock:
+            self.remove(self.keys.get(id), id)
+            self.keys[id] = key
+            for gram in self.grams(key):
+                self.postings.setdefault(gram, set()).add(id)
+
+    def remove(self, key, id):
+        with self.lock:
+            if key is None or self.keys.get(id) != key:
+                return
+
+            del self.keys[id]
+            for gram in self.grams(key):
+                ids = self.postings.get(gram, set())
+                ids.discard(id)
+                if not ids:
+                    self.postings.pop(gram, None)
+
+    def search(self, pattern: str, limit: int, after: int = 0) -> list:
+        """
+        Get up to `limit` ids greater than `after`, in id order, whose key contains `pattern`. A pattern with
+        wildcards (`*` for any characters, `?` for one character) has to match the whole key instead.
+        """
+
+        literals = [literal for literal in re.split(r"[*?]+", pattern) if literal]
+        if "*" in pattern or "?" in pattern:
+            regex = "".join(".*" if c == "*" else "." if c == "?" else re.escape(c) for c in pattern)
+            match = re.compile(regex).fullmatch
+        else:
+            match = re.compile(re.escape(pattern)).search
+
+        with self.lock:
+            grams = sorted(set().union(*map(self.grams, literals)), key=lambda gram: len(self.postings.get(gram, ())))
+            if grams:
+                candidates = set(self.postings.get(grams[0], ()))
+                for gram in grams[1:]:
+                    candidates &= self.postings.get(gram, set())
+            else:
+                candidates = self.keys.keys()
+
+            return heapq.nsmallest(limit, (id for id in candidates if id > after and match(self.keys[id])))
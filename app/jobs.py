@@ -0,0 +1,102 @@
+import datetime
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import select
+
+from log import Log
+
+from . import db
+from .models import Job
+
+log = Log("evolux-project").get_logger(logger_name="jobs")
+
+
+def get_progress(report: dict) -> dict:
+    return {key: value for key, value in report.items() if not isinstance(value, list)}
+
+
+def job_to_dict(job) -> dict:
+    return {
+        "id": job.id,
+        "name": job.name,
+        "status": job.status,
+        "progress": job.progress,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+class JobRunner:
+    """
+    Run jobs on a small thread pool inside an application context. Their status is kept in the jobs table (the last
+    JOBS_MAX_KEPT of them), written on connections of their own so it is seen by every worker process whatever the
+    state of the session of the job.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=app.config.get("JOBS_MAX_WORKERS", 2))
+
+    def submit(self, name, func, *args, **kwargs) -> dict:
+        job_id = uuid.uuid4().hex
+        table = Job.__table__
+        with db.engine.begin() as connection:
+            connection.execute(
+                table.insert().values(id=job_id, name=name, status="pending", created_at=datetime.datetime.utcnow())
+            )
+            oldest_kept = connection.execute(
+                select([table.c.created_at])
+                .order_by(table.c.created_at.desc())
+                .offset(self.app.config.get("JOBS_MAX_KEPT", 100) - 1)
+                .limit(1)
+            ).scalar()
+            if oldest_kept is not None:
+                connection.execute(table.delete().where(table.c.created_at < oldest_kept))
+
+        log.info("Submit job %s (%s)", name, job_id)
+        self.executor.submit(self.run, job_id, name, func, *args, **kwargs)
+        return self.get(job_id)
+
+    def update(self, job_id, **values):
+        table = Job.__table__
+        with db.engine.begin() as connection:
+            connection.execute(table.update().where(table.c.id == job_id).values(**values))
+
+    def run(self, job_id, name, func, *args, **kwargs):
+        with self.app.app_context():
+            self.update(job_id, status="running")
+            try:
+                result = func(
+                    *args, progress=lambda report: self.update(job_id, progress=get_progress(report)), **kwargs
+                )
+            except Exception as e:
+                log.error("Job %s (%s) failed: %s", name, job_id, e)
+                self.update(job_id, status="failed", error=str(e), finished_at=datetime.datetime.utcnow())
+            else:
+                self.update(job_id, status="finished", result=result, finished_at=datetime.datetime.utcnow())
+
+    def get(self, job_id):
+        """
+        Get the status of a job, run by any worker process, or None if there is no such job
+        """
+
+        table = Job.__table__
+        with db.engine.connect() as connection:
+            job = connection.execute(select([table]).where(table.c.id == job_id)).first()
+
+        return job_to_dict(job) if job is not None else None
+
+
+def get_job_runner() -> JobRunner:
+    """
+    Get the job runner of the current application
+    """
+
+    if "jobs" not in current_app.extensions:
+        current_app.extensions["jobs"] = JobRunner(current_app._get_current_object())
+
+    return current_app.extensions["jobs"]
@@ -0,0 +1,149 @@
+import bisect
+import threading
+import time
+import uuid
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from log import Log
+
+log = Log("evolux-project").get_logger(logger_name="app")
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Count the observations falling in each of the fixed BUCKETS (plus one for larger values), with their sum
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+    def samples(self, name: str, labels: str) -> list:
+        lines, total = [], 0
+        for bound, count in zip((*BUCKETS, "+Inf"), self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {total}")
+        return lines
+
+
+class Metrics:
+    """
+    Per-endpoint request counts by method and status, and histograms of the request latency and of the time spent in
+    the database. A request only takes the lock for a few additions.
+    """
+
+    def __init__(self):
+        self.requests = {}
+        self.latency = {}
+        self.db_time = {}
+        self.lock = threading.Lock()
+
+    def observe(self, endpoint: str, method: str, status: int, elapsed: float, db_time: float):
+        with self.lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault(endpoint, Histogram()).observe(elapsed)
+            self.db_time.setdefault(endpoint, Histogram()).observe(db_time)
+
+    def render(self, caches: dict = None) -> str:
+        """
+        Render the metrics, and the stats of the given caches, in the Prometheus text format
+        """
+
+        lines = [
+            "# HELP http_requests_total Number of HTTP requests by endpoint, method and status.",
+            "# TYPE http_requests_total counter",
+        ]
+        with self.lock:
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                labels = f'endpoint="{escape(endpoint)}",method="{method}",status="{status}"'
+                lines.append(f"http_requests_total{{{labels}}} {count}")
+
+            for name, histograms, description in (
+                ("http_request_duration_seconds", self.latency, "Time spent handling the HTTP requests."),
+                ("http_request_db_duration_seconds", self.db_time, "Time spent in the database by the HTTP requests."),
+            ):
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+                for endpoint, histogram in sorted(histograms.items()):
+                    lines += histogram.samples(name, f'endpoint="{escape(endpoint)}"')
+
+        caches = sorted((caches or {}).items())
+        for name, kind, stat, description in (
+            ("cache_hits_total", "counter", "hits", "Number of cache hits."),
+            ("cache_misses_total", "counter", "misses", "Number of cache misses."),
+            ("cache_size", "gauge", "size", "Number of entries in the cache."),
+        ):
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+            lines += [f'{name}{{cache="{escape(cache)}"}} {stats[stat]}' for cache, stats in caches]
+
+        return "\n".join(lines) + "\n"
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def get_metrics() -> Metrics:
+    return current_app.extensions.setdefault("metrics", Metrics())
+
+
+def start_request():
+    g.request_id = request.headers.get("X-Request-ID", "")[:64] or uuid.uuid4().hex
+    g.request_started = time.perf_counter()
+
+
+def finish_request(response):
+    response.headers["X-Request-ID"] = g.request_id
+    g.response_status = response.status_code
+    log.info("%s %s %s", request.method, request.path, response.status_code, extra={"rate_limit": False})
+    return response
+
+
+def record_request(exception=None):
+    started, status, db_time = g.pop("request_started", None), g.pop("response_status", 500), g.pop("db_time", 0.0)
+    if started is not None:
+        get_metrics().observe(
+            endpoint=request.endpoint or "unmatched",
+            method=request.method,
+            status=status,
+            elapsed=time.perf_counter() - started,
+            db_time=db_time,
+        )
+
+
+def init_app(app):
+    """
+    Register the request hooks that tag each request with an id, log it and record its metrics
+    """
+
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(record_request)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def finish_query(conn, cursor, statement, parameters, context, executemany):
+    """
+    Add the time of a query to the database time of the current request
+    """
+
+    started = getattr(context, "query_started", None)
+    if started is not None and has_request_context():
+        g.db_time = g.get("db_time", 0.0) + time.perf_counter() - started
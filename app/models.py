@@ -1,8 +1,18 @@
-from flask import url_for
+import re
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, has_app_context, url_for
 from flask_login import UserMixin
-from werkzeug.security import check_password_hash, generate_password_hash
+from sqlalchemy import event, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import attributes
 
-from app import db, login_manager, ma
+from app import db, hashing, login_manager, ma
+from app.cache import get_cache
+from app.generation import get_generations
+from app.indexes import SuggestIndex
 from log import Log
 
 log = Log("evolux-project").get_logger(logger_name="models")
@@ -22,22 +32,51 @@ class Employee(UserMixin, db.Model):
     username = db.Column(db.String(60), index=True, unique=True)
     password_hash = db.Column(db.String(100))
     is_admin = db.Column(db.Boolean, default=False)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1", onupdate=db.text("version + 1"))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def check_password(self, password):
         """
         Check if hashed password matches with actual password
         """
 
-        log.info("Check if the password is correct")
-        return check_password_hash(self.password_hash, password)
+        log.debug("Check if the password is correct")
+        return hashing.check_password(self.password_hash, password)
+
+    def get_suggestion(self) -> tuple:
+        """
+        Get the (id, keys, record) entry of the employee in the suggestions index
+        """
+
+        keys = (self.first_name, self.last_name, self.username, self.email)
+        record = {
+            "id": self.id,
+            "first_name": self.first_name,
+            "last_name": self.last_name,
+            "username": self.username,
+            "email": self.email,
+        }
+        return self.id, keys, record
+
+    def rehash_password(self, password) -> bool:
+        """
+        Hash the password again if its hash was made with another work factor than the configured one
+        """
+
+        if not hashing.needs_rehash(self.password_hash):
+            return False
+
+        log.info("Rehash the password with the configured work factor")
+        self.password_hash = hashing.hash_password(password)
+        return True
 
-    def __init__(self, first_name, last_name, email, username, password, is_admin=False):
-        log.info("Create an employee instance")
+    def __init__(self, first_name, last_name, email, username, password=None, is_admin=False, password_hash=None):
+        log.debug("Create an employee instance")
         self.first_name = first_name
         self.last_name = last_name
         self.email = email
         self.username = username
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hash or hashing.hash_password(password)
         self.is_admin = is_admin
 
     def __repr__(self):
@@ -56,11 +95,130 @@ employee_schema = EmployeeSchema()
 employees_schema = EmployeeSchema(many=True)
 
 
+class EmployeeSnapshot(UserMixin):
+    """
+    An immutable copy of the employee fields needed to authenticate and authorize requests, cheap to cache
+    """
+
+    __slots__ = ("_id", "_username", "_is_admin")
+
+    def __init__(self, id, username, is_admin):
+        object.__setattr__(self, "_id", id)
+        object.__setattr__(self, "_username", username)
+        object.__setattr__(self, "_is_admin", bool(is_admin))
+
+    @classmethod
+    def of(cls, employee):
+        return cls(employee.id, employee.username, employee.is_admin)
+
+    id = property(lambda self: self._id)
+    username = property(lambda self: self._username)
+    is_admin = property(lambda self: self._is_admin)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self):
+        return f"<EmployeeSnapshot: {self.username}>"
+
+
+def get_employee_cache():
+    """
+    Get the cache of authenticated employees of the current application. Each snapshot is kept with the generation
+    of the employees table it was read at, and is stale once the generation moved (after a write in any worker).
+    """
+
+    return get_cache(
+        "employees",
+        maxsize=current_app.config.get("EMPLOYEE_CACHE_SIZE", 10000),
+        ttl=current_app.config.get("EMPLOYEE_CACHE_TTL", 300),
+    )
+
+
+def get_employee_index() -> SuggestIndex:
+    """
+    Get the suggestions index of employees of the current application. It is (re)built from the database when it was
+    never built, or after EMPLOYEES_SUGGEST_MAX_AGE seconds (to pick up writes made by other processes).
+    """
+
+    index = current_app.extensions.setdefault(
+        "employees-suggest-index", SuggestIndex(current_app.config.get("EMPLOYEES_SUGGEST_MAX_KEYS", 200000))
+    )
+    max_age = current_app.config.get("EMPLOYEES_SUGGEST_MAX_AGE", 300)
+    with index.lock:
+        if index.built_at is None or time.monotonic() - index.built_at > max_age:
+            log.info("Build the suggestions index of employees")
+            index.build(employee.get_suggestion() for employee in Employee.query)
+
+    return index
+
+
 # Set up user_loader
 @login_manager.user_loader
 def load_user(user_id):
-    log.info("Set up an user loader")
-    return Employee.query.get(int(user_id))
+    log.debug("Set up an user loader")
+    cache = get_employee_cache()
+    generation, _ = get_generations().get("employees")
+    cached_generation, employee = cache.get(int(user_id), (None, None))
+    if employee is None or cached_generation != generation:
+        employee = Employee.query.get(int(user_id))
+        if employee is None:
+            return None
+
+        employee = EmployeeSnapshot.of(employee)
+        cache.set(employee.id, (generation, employee))
+
+    g.employee_id = employee.id
+    return employee
+
+
+@event.listens_for(db.session, "after_flush")
+def collect_changed_employees(session, flush_context):
+    """
+    Remember the employees added, modified or deleted in the transaction, to update the suggestions index and bump
+    the employees generation (which makes the cached employees stale) once committed
+    """
+
+    suggestions = session.info.setdefault("employee_suggestions", {})
+    for employee in session.new | session.dirty:
+        if isinstance(employee, Employee):
+            suggestions[employee.id] = employee.get_suggestion()
+    for employee in session.deleted:
+        if isinstance(employee, Employee):
+            suggestions[employee.id] = None
+
+
+@event.listens_for(db.session, "after_commit")
+def invalidate_changed_employees(session):
+    suggestions = session.info.pop("employee_suggestions", {})
+    if suggestions and has_app_context():
+        get_generations().bump("employees")
+
+    index = current_app.extensions.get("employees-suggest-index") if has_app_context() else None
+    if suggestions and index is not None and index.built_at is not None:
+        for id, suggestion in suggestions.items():
+            if suggestion is None:
+                index.remove(id)
+            else:
+                index.put(*suggestion)
+
+
+@event.listens_for(db.session, "after_rollback")
+def forget_changed_employees(session):
+    session.info.pop("employee_suggestions", None)
+
+
+def get_value_digits(value):
+    """
+    Get the digits of a DID number value, its normalized key ("+55 84 91234-4320" and "5584912344320" are the same
+    number), or None when it has none
+    """
+
+    return re.sub(r"\D", "", value) or None if isinstance(value, str) else None
+
+
+def default_digits(context):
+    return get_value_digits(context.get_current_parameters().get("value"))
 
 
 class DidNumber(db.Model):
@@ -69,12 +227,19 @@ class DidNumber(db.Model):
     """
 
     __tablename__ = "didnumbers"
+    __table_args__ = (
+        db.Index("ix_didnumbers_currency_monthly_price", "currency", "monthly_price"),
+        db.Index("ix_didnumbers_currency_setup_price", "currency", "setup_price"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     value = db.Column(db.String(17), unique=True)
-    monthly_price = db.Column(db.Float)
-    setup_price = db.Column(db.Float)
+    digits = db.Column(db.String(17), index=True, unique=True, default=default_digits)
+    monthly_price = db.Column(db.Float, index=True)
+    setup_price = db.Column(db.Float, index=True)
     currency = db.Column(db.String(3))
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1", onupdate=db.text("version + 1"))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def get_url(self):
         return url_for("user.list_didnumbers", id=self.id, _external=True)
@@ -91,7 +256,7 @@ class DidNumber(db.Model):
         return data
 
     def __init__(self, value, monthly_price, setup_price, currency):
-        log.info("Create a DID number instance")
+        log.debug("Create a DID number instance")
         self.value = value
         self.monthly_price = monthly_price
         self.setup_price = setup_price
@@ -101,6 +266,15 @@ class DidNumber(db.Model):
         return f"<DIDNumber: {self.value}>"
 
 
+@event.listens_for(DidNumber.value, "set")
+def set_did_number_digits(did_number, value, old_value, initiator):
+    """
+    Keep the normalized digits of a DID number in step with its value (Core inserts get them from the column default)
+    """
+
+    did_number.digits = get_value_digits(value)
+
+
 class DidNumberSchema(ma.Schema):
     class Meta:
         # Fields to expose
@@ -111,3 +285,112 @@ class DidNumberSchema(ma.Schema):
 
 did_number_schema = DidNumberSchema()
 did_numbers_schema = DidNumberSchema(many=True)
+
+
+class DidNumberCount(db.Model):
+    """
+    Create a table with the number of DID numbers per currency, maintained in the same transaction as the writes to
+    the DID Number table so listings do not need a COUNT(*)
+    """
+
+    __tablename__ = "didnumber_counts"
+
+    currency = db.Column(db.String(3), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def adjust(deltas, session=None):
+        """
+        Add the given deltas (currency -> number of rows added or removed) to the counters. The counter of a new
+        currency is inserted in a savepoint, so when a concurrent transaction inserted it first the update is retried
+        instead of failing the write.
+        """
+
+        session = session or db.session
+        table = DidNumberCount.__table__
+        for currency, delta in deltas.items():
+            if not delta:
+                continue
+            key = currency or ""
+            update = table.update().where(table.c.currency == key).values(total=table.c.total + delta)
+            if session.execute(update).rowcount:
+                continue
+
+            connection = session.connection()
+            savepoint = connection.begin_nested()
+            try:
+                connection.execute(table.insert().values(currency=key, total=delta))
+                savepoint.commit()
+            except IntegrityError:
+                log.info("The counter of the currency %s was added meanwhile", key)
+                savepoint.rollback()
+                session.execute(update)
+
+    @staticmethod
+    def get_total(currency=None) -> int:
+        """
+        Get the number of DID numbers, for a currency or for all of them
+        """
+
+        if currency is not None:
+            total = db.session.query(DidNumberCount.total).filter_by(currency=currency or "").scalar()
+        else:
+            total = db.session.query(func.sum(DidNumberCount.total)).scalar()
+
+        return total or 0
+
+    @staticmethod
+    def rebuild():
+        """
+        Recompute the counters from the DID Number table
+        """
+
+        log.info("Rebuild the DID numbers counters")
+        db.session.query(DidNumberCount).delete()
+        rows = db.session.query(DidNumber.currency, func.count(DidNumber.id)).group_by(DidNumber.currency)
+        DidNumberCount.adjust(dict(rows))
+        db.session.commit()
+
+
+class Job(db.Model):
+    """
+    Create a table with the status of the background jobs, so any worker process can report the jobs run by the others
+    """
+
+    __tablename__ = "jobs"
+
+    id = db.Column(db.String(32), primary_key=True)
+    name = db.Column(db.String(60))
+    status = db.Column(db.String(10))
+    progress = db.Column(db.JSON)
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, index=True)
+    finished_at = db.Column(db.DateTime)
+
+
+@event.listens_for(db.session, "before_flush")
+def update_did_number_counts(session, flush_context, instances):
+    """
+    Keep the DID numbers counters up to date with the DID numbers added, deleted or moved to another currency
+    through the ORM
+    """
+
+    deltas = Counter()
+    for did_number in session.new:
+        if isinstance(did_number, DidNumber):
+            deltas[did_number.currency] += 1
+
+    for did_number in session.deleted:
+        if isinstance(did_number, DidNumber):
+            deltas[(attributes.get_history(did_number, "currency").non_added() or [did_number.currency])[0]] -= 1
+
+    for did_number in session.dirty:
+        if isinstance(did_number, DidNumber):
+            history = attributes.get_history(did_number, "currency")
+            if history.added and history.deleted and history.added[0] != history.deleted[0]:
+                deltas[history.deleted[0]] -= 1
+                deltas[history.added[0]] += 1
+
+    if deltas:
+        DidNumberCount.adjust(deltas, session=session)
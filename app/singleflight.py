@@ -0,0 +1,82 @@
+import threading
+from concurrent.futures import Future, TimeoutError
+from functools import wraps
+
+from flask import current_app, request
+from flask_login import current_user
+
+from log import Log
+
+log = Log("evolux-project").get_logger(logger_name="singleflight")
+
+
+class SingleFlight:
+    """
+    Run a function once for concurrent calls with the same key: the first call runs it, the calls made while it runs
+    wait for it and get its result, or its exception
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, func, timeout: float = None):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Future()
+
+        if not leader:
+            try:
+                return call.result(timeout)
+            except TimeoutError:
+                log.warning("Stop waiting for the call %s", key)
+                return func()
+
+        try:
+            result = func()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+def get_single_flight() -> SingleFlight:
+    return current_app.extensions.setdefault("single-flight", SingleFlight())
+
+
+def coalesce(view):
+    """
+    Coalesce identical concurrent GET requests to a view: only one of them runs the view and all of them get a copy of
+    its response. Requests are identical when they have the same path, query string, conditional headers and admin
+    flag (so the admin checks of the view still apply).
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != "GET":
+            return view(*args, **kwargs)
+
+        def run():
+            response = current_app.make_response(view(*args, **kwargs))
+            return response.get_data(), response.status_code, list(response.headers.items())
+
+        key = (
+            request.path,
+            request.query_string,
+            request.headers.get("If-None-Match"),
+            request.headers.get("If-Modified-Since"),
+            getattr(current_user, "is_admin", False),
+        )
+        body, status, headers = get_single_flight().do(
+            key, run, timeout=current_app.config.get("SINGLE_FLIGHT_TIMEOUT", 30)
+        )
+        return current_app.response_class(body, status=status, headers=headers)
+
+    return wrapper
@@ -1,14 +1,71 @@
-from flask import abort, jsonify, request, url_for
+import base64
+import binascii
+import csv
+import io
+import json
+import operator
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime
+from urllib.parse import urlencode
+
+from flask import Response, abort, current_app, g, jsonify, request, stream_with_context, url_for
 from flask_login import current_user, login_required
+from sqlalchemy import and_, func, or_, true
 from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.orm import load_only
 
 from log import Log
 from . import user
 from .. import db
-from ..models import DidNumber, did_number_schema, did_numbers_schema, Employee, employee_schema, employees_schema
+from ..bulk import (
+    BATCH_MODES,
+    FILE_FORMATS,
+    batch_did_numbers,
+    chunked,
+    delete_did_numbers,
+    get_price_change,
+    import_did_numbers_file,
+    update_did_numbers,
+)
+from ..cache import get_cache
+from ..events import did_numbers_changed, on_did_numbers_changed
+from ..generation import get_generations
+from ..indexes import NGramIndex, PrefixIndex
+from ..jobs import get_job_runner
+from ..metrics import get_metrics
+from ..models import (
+    DidNumber,
+    DidNumberCount,
+    did_number_schema,
+    did_numbers_schema,
+    Employee,
+    EmployeeSchema,
+    employee_schema,
+    employees_schema,
+    get_employee_index,
+    get_value_digits,
+)
+from ..singleflight import coalesce
 
 log = Log("evolux-project").get_logger(logger_name="user-views")
 
+PAGING_PARAMS = ("start", "limit", "after", "before")
+FILTER_PARAMS = ("ids", "prefix", "min_monthly_price", "max_monthly_price", "min_setup_price", "max_setup_price")
+BULK_FILTER_KEYS = FILTER_PARAMS + ("currency",)
+COUNT_MODES = ("exact", "estimated", "none")
+SORT_COLUMNS = {
+    "id": DidNumber.id,
+    "value": DidNumber.value,
+    "monthly_price": DidNumber.monthly_price,
+    "setup_price": DidNumber.setup_price,
+    "currency": DidNumber.currency,
+}
+EMPLOYEE_SEARCH_COLUMNS = (Employee.first_name, Employee.last_name, Employee.username)
+EMPLOYEE_FIELDS = EmployeeSchema.Meta.fields
+
 
 def check_admin():
     """
@@ -19,87 +76,778 @@ def check_admin():
         abort(403, "The current user is not an admin")
 
 
-def get_paginated_list(klass, url: str, start: int, limit: int) -> dict:
+def not_modified(etag: str, last_modified):
+    """
+    Build a 304 response when the client already has the representation with this ETag (or, without If-None-Match,
+    one not older than `last_modified`), so the caller can skip the serialization
+    """
+
+    if request.method != "GET":
+        return None
+
+    if request.if_none_match:
+        matched = request.if_none_match.contains(etag)
+    else:
+        matched = request.if_modified_since is not None and last_modified.replace(microsecond=0) <= (
+            request.if_modified_since
+        )
+
+    if not matched:
+        return None
+
+    log.info("The client representation is still valid")
+    return set_validators(current_app.response_class(status=304), etag, last_modified)
+
+
+def set_validators(response, etag: str, last_modified):
+    """
+    Add the ETag and Last-Modified headers to a response
+    """
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
+
+
+def get_row_validators(name: str, row) -> tuple:
+    """
+    Get the ETag and Last-Modified of a row, from its version and update time (so a reused id gets another ETag)
+    """
+
+    updated_at = row.updated_at or datetime.utcfromtimestamp(0)
+    return f"{name}-{row.id}-{row.version}-{int(updated_at.timestamp() * 1000000)}", updated_at
+
+
+def get_table_validators(name: str) -> tuple:
+    """
+    Get the ETag and Last-Modified of a listing of a table, from the generation of the table
+    """
+
+    generation, last_modified = get_generations().get(name)
+    return f"{name}-{generation}", last_modified
+
+
+@on_did_numbers_changed
+def bump_did_numbers_generation(added, removed):
+    """
+    Bump the generation of the DID numbers, keeping its generations before and after for the listeners that follow
+    """
+
+    g.did_numbers_generations = get_generations().bump("didnumbers")
+
+
+def get_response_cache():
+    """
+    Get the cache of list responses of the current application
+    """
+
+    return get_cache(
+        "responses",
+        maxsize=current_app.config.get("RESPONSE_CACHE_SIZE", 1000),
+        ttl=current_app.config.get("RESPONSE_CACHE_TTL", 300),
+    )
+
+
+def get_cached_response(etag: str):
+    """
+    Get the cached response of a GET request, by route and query string. The key holds the ETag of the listing, made
+    of the table generation, so a write in any worker makes the entries of every worker unreachable.
     """
-    Paginate response.
+
+    if request.method != "GET":
+        return None
+
+    cached = get_response_cache().get((request.path, request.query_string, etag))
+    if cached is None:
+        return None
+
+    log.info("Use the cached response")
+    body, mimetype = cached
+    return current_app.response_class(body, mimetype=mimetype)
+
+
+def cache_response(etag: str, response):
+    if request.method == "GET" and response.status_code == 200:
+        get_response_cache().set((request.path, request.query_string, etag), (response.get_data(), response.mimetype))
+
+    return response
+
+
+def page_url(url: str, **paging) -> str:
+    """
+    Build the url of another page, keeping the query parameters (filters, sort) of the current request
+    """
+
+    params = [(key, value) for key, value in request.args.items(multi=True) if key not in PAGING_PARAMS]
+    return url + "?" + urlencode(params + list(paging.items()))
+
+
+def get_paginated_list(klass, url: str, start: int, limit: int, count: int = None, skip_count: bool = False) -> dict:
+    """
+    Paginate response. `klass` can be a list or a query; a query is counted and sliced in SQL.
+    A known `count` can be given to avoid counting, or `skip_count` to find the next page by reading one more row
+    instead (a `count` given with it, such as an estimate, is only reported).
     Based on: https://aviaryan.com/blog/gsoc/paginated-apis-flask
     """
 
-    # check if page exists
     results = klass
-    count = len(results)
-    if not isinstance(start, int):
-        start = int(start)
-
-    if not isinstance(limit, int):
-        limit = int(limit)
+    start = get_start(start)
+    limit = get_limit(limit)
 
-    if count < start:
-        abort(404)
+    # check if page exists
+    if skip_count:
+        page = results[(start - 1) : (start + limit)]
+        has_next = len(page) > limit
+        page = page[:limit]
+        if start > 1 and not page:
+            abort(404)
+    else:
+        if count is None:
+            count = len(results) if isinstance(results, list) else results.count()
+        if start > 1 and count < start:
+            abort(404)
+        has_next = start + limit <= count
 
     # make response
     obj = {"start": start, "limit": limit, "count": count}
 
-    log.info("Build the urls to return")
+    log.debug("Build the urls to return")
     # make previous url
     if start == 1:
         obj["previous"] = ""
     else:
         start_copy = max(1, start - limit)
         limit_copy = start - 1
-        obj["previous"] = url + "?start=%d&limit=%d" % (start_copy, limit_copy)
+        obj["previous"] = page_url(url, start=start_copy, limit=limit_copy)
 
     # make next url
-    if start + limit > count:
+    if not has_next:
         obj["next"] = ""
     else:
         start_copy = start + limit
-        obj["next"] = url + "?start=%d&limit=%d" % (start_copy, limit)
+        obj["next"] = page_url(url, start=start_copy, limit=limit)
 
-    log.info("Extract result according to the bounds")
-    obj["results"] = results[(start - 1) : (start - 1 + limit)]
+    log.debug("Extract result according to the bounds")
+    obj["results"] = page if skip_count else results[(start - 1) : (start - 1 + limit)]
     return obj
 
 
+def encode_cursor(id: int, **position) -> str:
+    """
+    Build an opaque cursor pointing to a row id (and any other sort key of the position)
+    """
+
+    position["id"] = id
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """
+    Get the position (row id and other sort keys) back from an opaque cursor
+    """
+
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        position["id"] = int(position["id"])
+        return position
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        abort(400, f"Invalid cursor: {cursor}")
+
+
+def get_start(start) -> int:
+    """
+    Validate the (1-based) position of the first result of a page
+    """
+
+    try:
+        start = int(start)
+    except (TypeError, ValueError):
+        abort(400, f"Invalid start: {start}")
+
+    if start < 1:
+        abort(400, f"Invalid start: {start}")
+
+    return start
+
+
+def get_limit(limit) -> int:
+    """
+    Validate a page size and bound it by the PAGINATION_MAX_LIMIT setting
+    """
+
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        abort(400, f"Invalid limit: {limit}")
+
+    if limit < 1:
+        abort(400, f"Invalid limit: {limit}")
+
+    return min(limit, current_app.config.get("PAGINATION_MAX_LIMIT", 1000))
+
+
+def get_cursor_list(
+    query, column, url: str, after: str, before: str, limit: int, sort_column=None, descending: bool = False
+) -> dict:
+    """
+    Paginate response using keyset (cursor) pagination on (`sort_column`, `column`), where `column` is the row id.
+    Only `limit + 1` rows are read from the database, so the cost of a page does not depend on how deep it is in
+    the table. Rows whose `sort_column` is NULL sort before all the others, as in the offset pagination on SQLite and
+    MySQL, and are read as a segment of their own ordered by id.
+    """
+
+    limit = get_limit(limit)
+
+    def beyond(position, greater, nulls):
+        """
+        Get the condition of the rows of a segment (NULL sort keys or not) past the cursor position, None if none is
+        """
+
+        compare = operator.gt if greater else operator.lt
+        key = position.get("key")
+        if sort_column is None or (nulls and key is None):
+            return compare(column, position["id"])
+        if nulls or key is None:
+            # the cursor is in the other segment, which the NULL segment comes before
+            return true() if nulls != greater else None
+        return or_(compare(sort_column, key), and_(sort_column == key, compare(column, position["id"])))
+
+    def read(cursor, forward):
+        """
+        Read up to `limit + 1` rows after (`forward`) or before the cursor, in the reading order
+        """
+
+        greater = forward != descending
+        position = decode_cursor(cursor) if cursor else None
+        rows = []
+        for nulls in [None] if sort_column is None else [True, False] if greater else [False, True]:
+            segment, columns = query, [column]
+            if nulls is not None:
+                segment = query.filter(sort_column.is_(None) if nulls else sort_column.isnot(None))
+                columns = [column] if nulls else [sort_column, column]
+            if position is not None:
+                condition = beyond(position, greater, nulls)
+                if condition is None:
+                    continue
+                segment = segment.filter(condition)
+            ordering = [c.asc() if greater else c.desc() for c in columns]
+            rows += segment.order_by(*ordering).limit(limit + 1 - len(rows)).all()
+            if len(rows) > limit:
+                break
+        return rows
+
+    def cursor_of(row):
+        if sort_column is None:
+            return encode_cursor(row.id)
+        return encode_cursor(row.id, key=getattr(row, sort_column.key))
+
+    log.info("Get a page of results after/before the cursor")
+    if before:
+        rows = read(before, False)
+        has_previous, has_next = len(rows) > limit, True
+        rows = rows[:limit][::-1]
+    else:
+        rows = read(after, True)
+        has_previous, has_next = bool(after), len(rows) > limit
+        rows = rows[:limit]
+
+    # make response
+    obj = {"limit": limit}
+
+    log.debug("Build the urls to return")
+    if has_previous and rows:
+        obj["previous"] = page_url(url, before=cursor_of(rows[0]), limit=limit)
+    elif has_previous:
+        obj["previous"] = page_url(url, before=after, limit=limit)
+    else:
+        obj["previous"] = ""
+
+    if has_next and rows:
+        obj["next"] = page_url(url, after=cursor_of(rows[-1]), limit=limit)
+    elif has_next:
+        obj["next"] = page_url(url, after=before, limit=limit)
+    else:
+        obj["next"] = ""
+
+    obj["results"] = rows
+    return obj
+
+
+def iter_chunks(query, column, chunk_size: int):
+    """
+    Read a query in fixed-size chunks ordered by `column` (keyset), so only one chunk is held in memory at a time
+    """
+
+    last = None
+    while True:
+        chunk_query = query if last is None else query.filter(column > last)
+        rows = chunk_query.order_by(column.asc()).limit(chunk_size).all()
+        if not rows:
+            return
+
+        yield rows
+        if len(rows) < chunk_size:
+            return
+
+        last = rows[-1].id
+
+
+def get_float(value, name: str) -> float:
+    """
+    Convert a request parameter to float
+    """
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        abort(400, f"Invalid value for {name}: {value}")
+
+
+def get_ids(ids) -> list:
+    """
+    Convert a list of ids or a comma separated string of ids to a list of int
+    """
+
+    if isinstance(ids, str):
+        ids = [id for id in ids.split(",") if id.strip()]
+
+    try:
+        return [int(id) for id in ids]
+    except (TypeError, ValueError):
+        abort(400, f"Invalid list of ids: {ids}")
+
+
+def prefix_range(column, prefix: str):
+    """
+    Match the values of `column` starting with `prefix` with a range on the column, which can use its index
+    (unlike a LIKE, which SQLite only runs on an index for case-insensitive columns)
+    """
+
+    return and_(column >= prefix, column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def filter_did_numbers(query, params):
+    """
+    Apply the DID number filters found in `params` (ids, value prefix, currency and price ranges) to a query
+    """
+
+    if params.get("ids") not in (None, ""):
+        query = query.filter(DidNumber.id.in_(get_ids(params["ids"])))
+
+    if params.get("prefix"):
+        query = query.filter(prefix_range(DidNumber.value, params["prefix"]))
+
+    if params.get("currency"):
+        query = query.filter(DidNumber.currency == params["currency"])
+
+    for name, column in (("monthly_price", DidNumber.monthly_price), ("setup_price", DidNumber.setup_price)):
+        if params.get(f"min_{name}") not in (None, ""):
+            query = query.filter(column >= get_float(params[f"min_{name}"], f"min_{name}"))
+        if params.get(f"max_{name}") not in (None, ""):
+            query = query.filter(column <= get_float(params[f"max_{name}"], f"max_{name}"))
+
+    return query
+
+
+def get_did_numbers_by_ids(ids: list) -> dict:
+    """
+    Get many DID numbers with chunked `IN` queries, keeping the requested order and reporting the missing ids
+    """
+
+    max_ids = current_app.config.get("DIDNUMBERS_MULTI_GET_MAX_IDS", 10000)
+    if len(ids) > max_ids:
+        abort(400, f"At most {max_ids} ids can be requested at once")
+
+    ids = list(dict.fromkeys(ids))
+    found = {}
+    for chunk in chunked(ids, current_app.config.get("DIDNUMBERS_IN_CHUNK_SIZE", 500)):
+        found.update((did_number.id, did_number) for did_number in DidNumber.query.filter(DidNumber.id.in_(chunk)))
+
+    return {
+        "results": did_numbers_schema.dump(found[id] for id in ids if id in found),
+        "missing": [id for id in ids if id not in found],
+    }
+
+
+def count_did_numbers(query, count_mode: str):
+    """
+    Count the DID numbers of a listing. The maintained counters are used when the listing is not filtered or only
+    by currency, and always with `estimated` (which then ignores the other filters, so the listing must not page by
+    it); `exact` falls back to a COUNT(*) for the other filters and `none` skips counting.
+    """
+
+    if count_mode == "none":
+        return None
+
+    if count_mode == "exact" and is_filtered():
+        log.info("Count the filtered DID numbers in the database")
+        return query.count()
+
+    return DidNumberCount.get_total(request.args.get("currency") or None)
+
+
+def is_filtered() -> bool:
+    """
+    Check if a listing is filtered by more than the currency, so the maintained counters do not count it
+    """
+
+    return any(request.args.get(param) not in (None, "") for param in FILTER_PARAMS)
+
+
 # DID number views
-@user.route("/didnumbers")
+@user.route("/didnumbers", methods=["GET", "POST"])
 @user.route("/didnumbers/page/<int:page>")
 @login_required
+@coalesce
 def list_didnumbers(page=1, per_page=20):
     """
-    List all DID numbers
+    List all DID numbers. Use `?after=<cursor>` or `?before=<cursor>` (an empty `after` starts at the beginning)
+    for cursor pagination, or `?start=<n>&limit=<n>` for offset pagination.
+    Filter with `currency`, `prefix`, `min_monthly_price`, `max_monthly_price`, `min_setup_price` and
+    `max_setup_price`, and sort with `sort=<column>&order=asc|desc`.
+    Use `count=exact|estimated|none` to choose how the total is counted (cursor pages have no total by default).
+    Use `?ids=1,5,9` (or POST `{"ids": [...]}` for long lists) to get many DID numbers at once.
     """
 
+    etag, last_modified = get_table_validators("didnumbers")
+    response = not_modified(etag, last_modified) or get_cached_response(etag)
+    if response is not None:
+        return set_validators(response, etag, last_modified)
+
+    if request.method == "POST" or "ids" in request.args:
+        payload = request.get_json(silent=True) if request.method == "POST" else request.args
+        if not payload or payload.get("ids") is None:
+            abort(400, "There is no key with that value: 'ids'")
+
+        log.info("Get many DID numbers by id from the database")
+        response = cache_response(etag, jsonify(get_did_numbers_by_ids(get_ids(payload["ids"]))))
+        return response if request.method == "POST" else set_validators(response, etag, last_modified)
+
+    sort = request.args.get("sort", "id")
+    order = request.args.get("order", "asc")
+    if sort not in SORT_COLUMNS or order not in ("asc", "desc"):
+        abort(400, f"Invalid sort: {sort} {order}")
+
+    count_mode = request.args.get("count", "exact")
+    if count_mode not in COUNT_MODES:
+        abort(400, f"Invalid count: {count_mode}")
+
+    query = filter_did_numbers(DidNumber.query, request.args)
     try:
         log.info("Get the list of DID numbers from the database")
-        all_did_numbers = did_numbers_schema.dump(DidNumber.query.order_by(DidNumber.id.asc()))
+        if "after" in request.args or "before" in request.args:
+            data = get_cursor_list(
+                query=query,
+                column=DidNumber.id,
+                url=url_for("user.list_didnumbers"),
+                after=request.args.get("after"),
+                before=request.args.get("before"),
+                limit=request.args.get("limit", per_page),
+                sort_column=SORT_COLUMNS[sort] if sort != "id" else None,
+                descending=order == "desc",
+            )
+            if "count" in request.args:
+                data["count"] = count_did_numbers(query, count_mode)
+        else:
+            ordering = [SORT_COLUMNS[sort], DidNumber.id]
+            data = get_paginated_list(
+                klass=query.order_by(*(c.desc() if order == "desc" else c.asc() for c in ordering)),
+                url=url_for("user.list_didnumbers"),
+                start=request.args.get("start", page),
+                limit=request.args.get("limit", per_page),
+                count=count_did_numbers(query, count_mode),
+                skip_count=count_mode == "none" or (count_mode == "estimated" and is_filtered()),
+            )
     except OperationalError:
         log.info("There is no DID numbers in the database")
-        all_did_numbers = None
-
-    if all_did_numbers is None:
         return jsonify({"warning": "There is no data to show"})
 
-    data = get_paginated_list(
-        klass=all_did_numbers,
-        url=url_for("user.list_didnumbers"),
-        start=request.args.get("start", page),
-        limit=request.args.get("limit", per_page),
-    )
+    data["results"] = did_numbers_schema.dump(data["results"])
 
     log.info("Response the list of DID numbers")
-    return jsonify(data)
+    return set_validators(cache_response(etag, jsonify(data)), etag, last_modified)
+
+
+@user.route("/didnumbers/export")
+@login_required
+def export_didnumbers():
+    """
+    Stream the DID numbers as NDJSON (default) or CSV, optionally filtered by currency and price ranges
+    """
+
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in ("ndjson", "csv"):
+        abort(400, f"Invalid export format: {export_format}")
+
+    fields = ("id", "value", "monthly_price", "setup_price", "currency")
+    query = filter_did_numbers(db.session.query(*(getattr(DidNumber, field) for field in fields)), request.args)
+    chunk_size = current_app.config.get("DIDNUMBERS_EXPORT_CHUNK_SIZE", 1000)
+
+    def generate():
+        if export_format == "csv":
+            yield ",".join(fields) + "\r\n"
+
+        for rows in iter_chunks(query, DidNumber.id, chunk_size):
+            buffer = io.StringIO()
+            if export_format == "csv":
+                csv.writer(buffer).writerows(rows)
+            else:
+                for row in rows:
+                    buffer.write(json.dumps(dict(zip(fields, row))) + "\n")
+            yield buffer.getvalue()
+
+        log.info("DID numbers export finished")
+
+    log.info("Export DID numbers as %s", export_format)
+    mimetype = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f"attachment; filename=didnumbers.{export_format}"}
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+
+@user.route("/didnumbers/import", methods=["POST"])
+@login_required
+def import_didnumbers():
+    """
+    Import DID numbers from a CSV or NDJSON upload (multipart `file` field or raw body) in a background job
+    """
+
+    upload = request.files.get("file")
+    filename = upload.filename if upload else ""
+    import_format = request.args.get("format") or os.path.splitext(filename)[1].lstrip(".").lower() or "csv"
+    if import_format not in FILE_FORMATS:
+        abort(400, f"Invalid import format: {import_format}")
+
+    log.info("Spool the uploaded file to disk")
+    with tempfile.NamedTemporaryFile(suffix=f".{import_format}", delete=False) as spool:
+        shutil.copyfileobj(upload.stream if upload else request.stream, spool)
+
+    job = get_job_runner().submit("import-didnumbers", import_did_numbers_file, spool.name, import_format, remove=True)
+    job["url"] = url_for("user.import_didnumbers_status", job_id=job["id"])
+    return jsonify(job), 202
+
+
+@user.route("/didnumbers/import/<job_id>")
+@login_required
+def import_didnumbers_status(job_id):
+    """
+    Get the status (and the report once finished) of a DID numbers import
+    """
+
+    job = get_job_runner().get(job_id)
+    if job is None:
+        abort(404, f"There is no import job {job_id}")
+
+    return jsonify(job), 200
 
 
 @user.route("/didnumbers/<int:id>", methods=["GET"])
 @login_required
+@coalesce
 def didnumber_detail(id):
     """
     List details for a DID number
     """
 
     did_number = DidNumber.query.get_or_404(id)
-    return did_number_schema.jsonify(did_number)
+    etag, last_modified = get_row_validators("didnumber", did_number)
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+
+    return set_validators(did_number_schema.jsonify(did_number), etag, last_modified)
+
+
+def get_value_cache():
+    """
+    Get the cache of DID number lookups by value. The keys hold the generation of the DID numbers table, so a write in
+    any worker makes the entries of every worker unreachable.
+    """
+
+    return get_cache(
+        "didnumbers-by-value",
+        maxsize=current_app.config.get("DIDNUMBERS_VALUE_CACHE_SIZE", 10000),
+        ttl=current_app.config.get("DIDNUMBERS_VALUE_CACHE_TTL", 60),
+    )
+
+
+@user.route("/didnumbers/by-value/<path:value>", methods=["GET"])
+@login_required
+def didnumber_by_value(value):
+    """
+    Get a DID number by its value in any formatting ("+55 84 91234-4320", "+5584912344320", "5584912344320"), looked
+    up by its digits
+    """
+
+    digits = get_value_digits(value)
+    if digits is None:
+        abort(404, f"There is no DID number {value}")
+
+    cache = get_value_cache()
+    generation, _ = get_generations().get("didnumbers")
+    data = cache.get((digits, generation))
+    if data is None:
+        log.info("Look up DID number %s in the database", digits)
+        did_number = DidNumber.query.filter_by(digits=digits).first()
+        if did_number is None:
+            abort(404, f"There is no DID number {value}")
+
+        data = did_number_schema.dump(did_number)
+        cache.set((digits, generation), data)
+
+    return jsonify(data)
+
+
+def get_digits(value: str) -> str:
+    """
+    Get the digits of a DID number value, used as key of the prefix index
+    """
+
+    return get_value_digits(value) or ""
+
+
+def load_did_numbers_index(index, name: str):
+    """
+    (Re)build an index of the digits of the DID numbers when it is not at the current generation of the table, so
+    it follows the writes of every process
+    """
+
+    generation, _ = get_generations().get("didnumbers")
+    with index.lock:
+        if index.generation != generation:
+            log.info("Build the %s index of DID numbers", name)
+            query = db.session.query(DidNumber.id, DidNumber.value).filter(DidNumber.value.isnot(None))
+            index.build(((get_digits(value), id) for id, value in query), generation)
+
+    return index
+
+
+def update_did_numbers_index(index, added, removed):
+    """
+    Apply the single writes of this process to an index of DID numbers. It is still in sync with the table only when
+    it was at the generation the write bumped; after bulk writes, or when another process wrote in between, it is
+    marked stale to be rebuilt.
+    """
+
+    if index is None:
+        return
+
+    before, after = g.get("did_numbers_generations", (None, None))
+    with index.lock:
+        if added is None or removed is None or index.generation is None or index.generation != before:
+            index.generation = None
+            return
+
+        for did_number in removed:
+            index.remove(get_digits(did_number["value"]), did_number["id"])
+        for did_number in added:
+            index.add(get_digits(did_number["value"]), did_number["id"])
+        index.generation = after
+
+
+def get_prefix_index() -> PrefixIndex:
+    """
+    Get the prefix index of DID numbers of the current application
+    """
+
+    return load_did_numbers_index(current_app.extensions.setdefault("didnumbers-prefix-index", PrefixIndex()), "prefix")
+
+
+@on_did_numbers_changed
+def update_prefix_index(added, removed):
+    update_did_numbers_index(current_app.extensions.get("didnumbers-prefix-index"), added, removed)
+
+
+def get_ngram_index() -> NGramIndex:
+    """
+    Get the n-gram index of DID numbers of the current application
+    """
+
+    return load_did_numbers_index(current_app.extensions.setdefault("didnumbers-ngram-index", NGramIndex()), "n-gram")
+
+
+@on_did_numbers_changed
+def update_ngram_index(added, removed):
+    update_did_numbers_index(current_app.extensions.get("didnumbers-ngram-index"), added, removed)
+
+
+@user.route("/didnumbers/prefix/<prefix>", methods=["GET"])
+@login_required
+@coalesce
+def didnumbers_by_prefix(prefix):
+    """
+    List the DID numbers whose digits start with a prefix, in digits order. Use `?after=<cursor>&limit=<n>` to page.
+    """
+
+    digits = get_digits(prefix)
+    if not digits:
+        abort(400, f"Invalid prefix: {prefix}")
+
+    limit = get_limit(request.args.get("limit", 20))
+    after = request.args.get("after")
+    if after:
+        position = decode_cursor(after)
+        after = (str(position.get("key", "")), position["id"])
+
+    entries = get_prefix_index().search(digits, limit + 1, after=after)
+    did_numbers = get_did_numbers_by_ids([id for _, id in entries[:limit]])["results"]
+    data = {"prefix": digits, "limit": limit, "next": "", "results": did_numbers}
+    if len(entries) > limit:
+        key, id = entries[limit - 1]
+        url = url_for("user.didnumbers_by_prefix", prefix=digits)
+        data["next"] = page_url(url, after=encode_cursor(id, key=key), limit=limit)
+
+    return jsonify(data)
+
+
+@user.route("/didnumbers/match/<number>", methods=["GET"])
+@login_required
+def didnumber_longest_match(number):
+    """
+    Rate a dialed number: get the DID number whose digits are the longest prefix of the number, with its prices
+    """
+
+    digits = get_digits(number)
+    if not digits:
+        abort(400, f"Invalid number: {number}")
+
+    key, ids = get_prefix_index().longest_match(digits)
+    if key is None:
+        abort(404, f"There is no DID number matching {number}")
+
+    did_number = get_did_numbers_by_ids(ids[:1])["results"]
+    if not did_number:
+        abort(404, f"There is no DID number matching {number}")
+
+    return jsonify({"number": digits, "prefix": key, "did_number": did_number[0]})
+
+
+@user.route("/didnumbers/search", methods=["GET"])
+@login_required
+@coalesce
+def search_didnumbers():
+    """
+    List the DID numbers whose digits contain a pattern (`?pattern=777`), or match a pattern with wildcards, `*` for
+    any digits and `?` for one digit (`?pattern=*2020` for the numbers ending in 2020), in id order.
+    Use `?after=<cursor>&limit=<n>` to page.
+    """
+
+    pattern = re.sub(r"[^\d*?]", "", request.args.get("pattern", ""))
+    if not re.search(r"\d", pattern):
+        abort(400, f"Invalid pattern: {request.args.get('pattern', '')}")
+
+    limit = get_limit(request.args.get("limit", 20))
+    after = request.args.get("after")
+    after = decode_cursor(after)["id"] if after else 0
+
+    ids = get_ngram_index().search(pattern, limit + 1, after=after)
+    did_numbers = get_did_numbers_by_ids(ids[:limit])["results"]
+    data = {"pattern": pattern, "limit": limit, "next": "", "results": did_numbers}
+    if len(ids) > limit:
+        url = url_for("user.search_didnumbers")
+        data["next"] = page_url(url, after=encode_cursor(ids[limit - 1]), limit=limit)
+
+    return jsonify(data)
 
 
 @user.route("/didnumbers/add", methods=["GET", "POST"])
@@ -128,7 +876,7 @@ def add_didnumber():
 
     try:
         # Add DID number to the database
-        log.info(f"Add DID number {did_number.value} to the database")
+        log.info("Add DID number %s to the database", did_number.value)
         db.session.add(did_number)
         db.session.commit()
     except SQLAlchemyError as e:
@@ -137,9 +885,46 @@ def add_didnumber():
     except Exception as e:
         abort(500, e)
 
+    did_numbers_changed(added=[did_number.serialize()], removed=[])
     return did_number_schema.jsonify(did_number), 201
 
 
+@user.route("/didnumbers/batch", methods=["POST"])
+@login_required
+def batch_didnumbers():
+    """
+    Add up to DIDNUMBERS_BATCH_MAX_ITEMS DID numbers at once. Use `mode=insert|upsert|skip-existing` to choose what
+    happens to values that already exist (`upsert` is for admins only). The body is an array of DID numbers or an
+    object with an `items` array.
+    """
+
+    payload = request.get_json(silent=True)
+    items = payload.get("items") if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        abort(400, "Expected an array of DID numbers")
+
+    max_items = current_app.config.get("DIDNUMBERS_BATCH_MAX_ITEMS", 5000)
+    if len(items) > max_items:
+        abort(400, f"A batch can have at most {max_items} DID numbers")
+
+    mode = request.args.get("mode") or (payload.get("mode") if isinstance(payload, dict) else None) or "insert"
+    if mode not in BATCH_MODES:
+        abort(400, f"Invalid batch mode: {mode}")
+
+    if mode == "upsert":
+        # Updating existing DID numbers needs the same permission as editing them
+        check_admin()
+
+    results = batch_did_numbers(items, mode)
+    did_numbers_changed()
+    data = {"mode": mode, "results": results}
+    for status in ("created", "updated", "skipped", "error"):
+        data[status] = sum(1 for result in results if result["status"] == status)
+
+    log.info("Batch finished: %s created, %s updated, %s errors", data["created"], data["updated"], data["error"])
+    return jsonify(data), 200
+
+
 @user.route("/didnumbers/edit/<int:id>", methods=["GET", "PUT"])
 @login_required
 def edit_did_number(id):
@@ -150,6 +935,7 @@ def edit_did_number(id):
     check_admin()
 
     did_number = DidNumber.query.get_or_404(id)
+    old_did_number = did_number.serialize()
     log.info("Set variables from request")
     try:
         did_number.value = request.json["value"]
@@ -161,7 +947,7 @@ def edit_did_number(id):
 
     try:
         # Edit DID number in the database
-        log.info(f"Edit DID number {did_number.value} in the database")
+        log.info("Edit DID number %s in the database", did_number.value)
         db.session.commit()
     except SQLAlchemyError as e:
         db.session.rollback()
@@ -169,6 +955,7 @@ def edit_did_number(id):
     except Exception as e:
         abort(500, e)
 
+    did_numbers_changed(added=[did_number.serialize()], removed=[old_did_number])
     return did_number_schema.jsonify(did_number), 200
 
 
@@ -182,8 +969,9 @@ def delete_did_number(id):
     check_admin()
 
     did_number = DidNumber.query.get_or_404(id)
+    old_did_number = did_number.serialize()
     try:
-        log.info(f"Delete {did_number} from the database")
+        log.info("Delete %s from the database", did_number)
         db.session.delete(did_number)
         db.session.commit()
     except SQLAlchemyError as e:
@@ -192,28 +980,177 @@ def delete_did_number(id):
     except Exception as e:
         abort(500, e)
 
+    did_numbers_changed(added=[], removed=[old_did_number])
+
     return jsonify({"message": "The DID number has successfully been deleted."}), 200
 
 
+def get_bulk_filter() -> dict:
+    """
+    Get the DID numbers filter of a bulk request: a `filter` object and/or an `ids` list. An empty filter is refused
+    so a bulk request never touches the whole table by mistake.
+    """
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        abort(400, "Expected an object with a filter")
+
+    criteria = payload.get("filter") or {}
+    if not isinstance(criteria, dict):
+        abort(400, "Expected an object with a filter")
+
+    unknown = [key for key in criteria if key not in BULK_FILTER_KEYS]
+    if unknown:
+        abort(400, f"Invalid filter: {', '.join(unknown)}")
+
+    criteria = dict(criteria)
+    if payload.get("ids") is not None:
+        criteria["ids"] = payload["ids"]
+
+    if not any(criteria.get(key) not in (None, "", []) for key in BULK_FILTER_KEYS):
+        abort(400, "A bulk request needs a filter or a list of ids")
+
+    return criteria
+
+
+@user.route("/didnumbers/bulk/edit", methods=["PUT"])
+@login_required
+def bulk_edit_did_numbers():
+    """
+    Edit every DID number matching a filter. `set` takes absolute values (monthlyPrice, setupPrice, currency) or
+    relative price changes such as "+5%" or "-0.5".
+    """
+
+    check_admin()
+
+    criteria = get_bulk_filter()
+    values = request.json.get("set")
+    if not isinstance(values, dict):
+        abort(400, "Expected an object with the values to set")
+
+    changes = {}
+    for key, column in (("monthlyPrice", DidNumber.monthly_price), ("setupPrice", DidNumber.setup_price)):
+        if key in values:
+            changes[column.key] = get_price_change(column, values[key])
+            if changes[column.key] is None:
+                abort(400, f"Invalid change for {key}: {values[key]}")
+    if "currency" in values:
+        currency = values["currency"]
+        if not isinstance(currency, str) or not 0 < len(currency.strip()) <= 3:
+            abort(400, f"Invalid currency: {currency}")
+        changes["currency"] = currency.strip()
+
+    if not changes:
+        abort(400, "There is nothing to set")
+
+    log.info("Bulk edit DID numbers matching %s", criteria)
+    updated = update_did_numbers(filter_did_numbers(db.session.query(DidNumber.id), criteria), changes)
+    did_numbers_changed()
+    return jsonify({"updated": updated}), 200
+
+
+@user.route("/didnumbers/bulk/delete", methods=["DELETE"])
+@login_required
+def bulk_delete_did_numbers():
+    """
+    Delete every DID number matching a filter
+    """
+
+    check_admin()
+
+    criteria = get_bulk_filter()
+    log.info("Bulk delete DID numbers matching %s", criteria)
+    deleted = delete_did_numbers(filter_did_numbers(db.session.query(DidNumber.id), criteria))
+    did_numbers_changed()
+    return jsonify({"deleted": deleted}), 200
+
+
 # Employee views
+def get_fields(fields: str) -> tuple:
+    """
+    Validate a comma-separated list of employee fields
+    """
+
+    fields = tuple(field.strip() for field in fields.split(",") if field.strip())
+    invalid = [field for field in fields if field not in EMPLOYEE_FIELDS]
+    if invalid or not fields:
+        abort(400, f"Invalid fields: {', '.join(invalid)}")
+
+    return fields
+
+
 @user.route("/employees")
 @login_required
+@coalesce
 def list_employees():
     """
-    List all employees
+    List all employees, paginated with `?start=<n>&limit=<n>`. Search with `q` (a prefix of the first name, last
+    name or username; a search with no match gives an empty page) and choose the fields to return with
+    `fields=id,username,...`.
     """
 
     check_admin()
 
+    etag, last_modified = get_table_validators("employees")
+    response = not_modified(etag, last_modified) or get_cached_response(etag)
+    if response is not None:
+        return set_validators(response, etag, last_modified)
+
+    query = Employee.query
+    q = request.args.get("q", "").strip()
+    if q:
+        log.info("Search employees starting with %s", q)
+        query = query.filter(or_(*(prefix_range(column, q) for column in EMPLOYEE_SEARCH_COLUMNS)))
+
+    schema = employees_schema
+    if "fields" in request.args:
+        fields = get_fields(request.args["fields"])
+        columns = [getattr(Employee, field) for field in fields if field != "id"]
+        query = query.options(load_only(*columns)) if columns else query.options(load_only(Employee.id))
+        schema = EmployeeSchema(many=True, only=fields)
+
     log.info("List all employees")
-    all_employees = Employee.query.all()
+    data = get_paginated_list(
+        klass=query.order_by(Employee.id),
+        url=url_for("user.list_employees"),
+        start=request.args.get("start", 1),
+        limit=get_limit(request.args.get("limit", 20)),
+    )
+
+    data["results"] = schema.dump(data["results"])
+    return set_validators(cache_response(etag, jsonify(data)), etag, last_modified), 200
+
+
+@user.route("/employees/suggest")
+@login_required
+def suggest_employees():
+    """
+    Suggest up to `k` employees whose first name, last name, username or email starts with `q` (case-insensitive),
+    from an in-memory index
+    """
+
+    check_admin()
+
+    q = request.args.get("q", "").strip().lower()
+    if not q:
+        abort(400, "There is no key with that value: 'q'")
 
-    result = employees_schema.dump(all_employees)
-    return jsonify(result), 200
+    k = get_limit(request.args.get("k", 10))
+    index = get_employee_index()
+    if index.complete:
+        log.debug("Suggest employees starting with %s from the index", q)
+        return jsonify({"results": index.suggest(q, k)})
+
+    log.info("The suggestions index is full, suggest employees starting with %s from the database", q)
+    prefix = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    columns = (Employee.first_name, Employee.last_name, Employee.username, Employee.email)
+    query = Employee.query.filter(or_(*(func.lower(column).like(prefix + "%", escape="\\") for column in columns)))
+    return jsonify({"results": [employee.get_suggestion()[2] for employee in query.order_by(Employee.id).limit(k)]})
 
 
 @user.route("/employees/<int:id>")
 @login_required
+@coalesce
 def employee_detail(id):
     """
     List details for an employee
@@ -221,4 +1158,22 @@ def employee_detail(id):
 
     check_admin()
     employee = Employee.query.get_or_404(id)
-    return employee_schema.jsonify(employee)
+    etag, last_modified = get_row_validators("employee", employee)
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+
+    return set_validators(employee_schema.jsonify(employee), etag, last_modified)
+
+
+@user.route("/metrics")
+@login_required
+def metrics():
+    """
+    Expose the request metrics and the cache stats in the Prometheus text format
+    """
+
+    check_admin()
+
+    caches = {name: cache.stats() for name, cache in current_app.extensions.get("caches", {}).items()}
+    return Response(get_metrics().render(caches), mimetype="text/plain; version=0.0.4")
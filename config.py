@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 
 class Config(object):
@@ -11,6 +12,60 @@ class Config(object):
     TESTING = False
     DATABASE_URI = "sqlite:///:memory:"
 
+    # Logging settings (logger name to level, on top of the LOG_LEVEL and LOG_LEVELS environment variables)
+    LOG_LEVELS = {}
+
+    # Authentication settings
+    EMPLOYEE_CACHE_SIZE = 10000
+    EMPLOYEE_CACHE_TTL = 300
+    TOKEN_ACCESS_TTL = 900
+    TOKEN_REFRESH_TTL = 86400
+    EMPLOYEES_BULK_MAX_ITEMS = 1000
+
+    # Employees suggestions settings
+    EMPLOYEES_SUGGEST_MAX_KEYS = 200000
+    EMPLOYEES_SUGGEST_MAX_AGE = 300
+
+    # Password hashing settings
+    PASSWORD_HASH_ITERATIONS = 150000
+    PASSWORD_HASH_WORKERS = os.cpu_count()
+    PASSWORD_HASH_MAX_PENDING = 64
+
+    # Pagination settings
+    PAGINATION_MAX_LIMIT = 1000
+
+    # DID numbers lookup by value settings
+    DIDNUMBERS_VALUE_CACHE_SIZE = 10000
+    DIDNUMBERS_VALUE_CACHE_TTL = 60
+
+    # Response cache settings (GENERATIONS_FILE defaults to a file in the instance folder)
+    GENERATIONS_FILE = None
+    RESPONSE_CACHE_SIZE = 1000
+    RESPONSE_CACHE_TTL = 300
+    SINGLE_FLIGHT_TIMEOUT = 30
+
+    # DID numbers export settings
+    DIDNUMBERS_EXPORT_CHUNK_SIZE = 1000
+
+    # DID numbers import settings
+    DIDNUMBERS_IMPORT_BATCH_SIZE = 5000
+    DIDNUMBERS_IMPORT_MAX_ERRORS = 1000
+    DIDNUMBERS_IN_CHUNK_SIZE = 500
+
+    # DID numbers multi-get settings
+    DIDNUMBERS_MULTI_GET_MAX_IDS = 10000
+
+    # DID numbers batch settings
+    DIDNUMBERS_BATCH_MAX_ITEMS = 5000
+    DIDNUMBERS_BATCH_CHUNK_SIZE = 500
+
+    # DID numbers bulk edit/delete settings
+    DIDNUMBERS_BULK_CHUNK_SIZE = 1000
+
+    # Background jobs settings
+    JOBS_MAX_WORKERS = 2
+    JOBS_MAX_KEPT = 100
+
 
 class DevelopmentConfig(Config):
     """
@@ -35,6 +90,9 @@ class TestingConfig(Config):
     """
 
     TESTING = True
+    PASSWORD_HASH_ITERATIONS = 1000
+    PASSWORD_HASH_WORKERS = 0
+    GENERATIONS_FILE = os.path.join(tempfile.gettempdir(), "evolux-project-test-generations")
 
 
 app_config = {"development": DevelopmentConfig, "production": ProductionConfig, "testing": TestingConfig}
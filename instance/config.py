@@ -0,0 +1 @@
+SQLALCHEMY_TRACK_MODIFICATIONS = False
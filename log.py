@@ -1,6 +1,21 @@
-import datetime
+import atexit
+import glob
+import gzip
+import json
 import logging
+import os
+import queue
+import shutil
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows, where only threads are synchronized
+    fcntl = None
 
 is_colorlog_presented = True
 try:
@@ -8,14 +23,287 @@ try:
 except ImportError:
     is_colorlog_presented = False
 
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+try:
+    from flask import g, has_request_context, request
+except ImportError:
+    has_request_context = None
+
+# Hand the records to a background thread, which owns the console and file handlers (LOG_QUEUE), through a queue of
+# LOG_QUEUE_SIZE records; when it is full the records are dropped or the callers wait (LOG_QUEUE_POLICY=drop|block)
+LOG_QUEUE = os.getenv("LOG_QUEUE", "true").lower() in ("1", "true", "yes")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_QUEUE_POLICY = os.getenv("LOG_QUEUE_POLICY", "drop")
+
+# The level of the loggers (LOG_LEVEL), overridden per logger with LOG_LEVELS="models=WARNING,user-views=INFO"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
+LOG_LEVELS = dict(
+    (name.strip(), level.strip().upper())
+    for name, _, level in (item.partition("=") for item in os.getenv("LOG_LEVELS", "").split(","))
+    if name.strip() and level.strip()
+)
+
+# Let at most LOG_RATE_LIMIT records per LOG_RATE_INTERVAL seconds through from each call site (0 to disable)
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "20"))
+LOG_RATE_INTERVAL = float(os.getenv("LOG_RATE_INTERVAL", "1"))
+
+# Rotate the log file at midnight or at LOG_MAX_BYTES bytes, compress the rotated files with gzip (LOG_COMPRESS) and
+# keep at most LOG_BACKUP_COUNT of them, taking at most LOG_MAX_TOTAL_BYTES bytes (0 for no limit)
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(100 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "30"))
+LOG_MAX_TOTAL_BYTES = int(os.getenv("LOG_MAX_TOTAL_BYTES", str(1024 * 1024 * 1024)))
+LOG_COMPRESS = os.getenv("LOG_COMPRESS", "true").lower() in ("1", "true", "yes")
+
+# Write free text lines or JSON lines with the request fields (LOG_FORMAT=text|json)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let at most `limit` records per `interval` seconds through from each call site (logger, file and line). The next
+    record let through from a call site tells how many of its records were suppressed.
+    """
+
+    def __init__(self, limit, interval):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.sites = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.limit or not getattr(record, "rate_limit", True):
+            return True
+
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            start, count, suppressed = self.sites.get(key, (now, 0, 0))
+            if now - start >= self.interval:
+                start, count = now, 0
+            if count >= self.limit:
+                self.sites[key] = (start, count, suppressed + 1)
+                return False
+            self.sites[key] = (start, count + 1, 0)
+
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Add the correlation id, route, employee id and elapsed time of the current request to the records
+    """
+
+    def filter(self, record):
+        if has_request_context is not None and has_request_context():
+            record.request_id = g.get("request_id")
+            record.route = request.url_rule.rule if request.url_rule else request.path
+            record.employee_id = g.get("employee_id")
+            started = g.get("request_started")
+            record.elapsed_ms = round((time.perf_counter() - started) * 1000, 3) if started else None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format the records as JSON lines, with the request fields added by RequestContextFilter
+    """
+
+    encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, default=str).encode
+    fields = ("request_id", "route", "employee_id", "elapsed_ms")
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in self.fields:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return self.encode(data)
+
+
+class SizedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """
+    Rotate the log file at midnight or once it reaches `max_bytes` bytes. The rotated files get the time of the
+    rotation in their name and are compressed with gzip on a background thread, which then removes the oldest ones
+    beyond `backup_count` files or `max_total_bytes` bytes.
+
+    Every worker process has its own handler on the same file, so writes and rotations are serialized with a lock on
+    the `<file>.lock` file, and a handler reopens the file (like WatchedFileHandler) once another process rotated it,
+    instead of writing to the renamed file or rotating it again.
+    """
+
+    def __init__(self, filename, max_bytes=0, backup_count=0, max_total_bytes=0, compress=True, when="midnight"):
+        super().__init__(filename, when=when, backupCount=backup_count)
+        self.max_bytes = max_bytes
+        self.max_total_bytes = max_total_bytes
+        self.compress = compress
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-rotation")
+        self.lock_fd = os.open(self.baseFilename + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+
+    @contextmanager
+    def file_lock(self):
+        """
+        Lock the log file against the handlers of the other processes
+        """
+
+        if fcntl is not None:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    def reopen_if_rotated(self):
+        """
+        Reopen the log file when another process rotated it, and skip the time rotation it already made
+        """
+
+        try:
+            stat = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            stat = None
+        if self.stream is not None:
+            opened = os.fstat(self.stream.fileno())
+            if stat is not None and (stat.st_dev, stat.st_ino) == (opened.st_dev, opened.st_ino):
+                return
+
+            self.stream.close()
+        self.stream = self._open()
+        now = int(time.time())
+        if now >= self.rolloverAt:
+            self.rolloverAt = self.computeRollover(now)
+
+    def emit(self, record):
+        with self.file_lock():
+            self.reopen_if_rotated()
+            super().emit(record)
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+
+        if self.max_bytes and self.stream is not None:
+            size = os.fstat(self.stream.fileno()).st_size
+            return size + len(self.format(record)) + len(self.terminator) > self.max_bytes
+
+        return False
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        rotated = name = f"{self.baseFilename}.{time.strftime('%Y%m%d-%H%M%S')}"
+        count = 0
+        while os.path.exists(name) or os.path.exists(name + ".gz"):
+            count += 1
+            name = f"{rotated}.{count}"
+        if os.path.exists(self.baseFilename):
+            os.rename(self.baseFilename, name)
+            self.worker.submit(self.archive, name)
+
+        self.stream = self._open()
+        now = int(time.time())
+        self.rolloverAt = self.computeRollover(now)
+
+    def archive(self, name):
+        """
+        Compress a rotated file, then remove the oldest rotated files past the retention limits
+        """
+        try:
+            if self.compress:
+                with open(name, "rb") as source, gzip.open(name + ".gz.tmp", "wb") as target:
+                    shutil.copyfileobj(source, target)
+                os.replace(name + ".gz.tmp", name + ".gz")
+                os.remove(name)
+            self.prune()
+        except OSError as e:
+            sys.stderr.write(f"Could not archive the log file {name}: {e}\n")
+
+    def prune(self):
+        rotated = [
+            name for name in glob.glob(glob.escape(self.baseFilename) + ".*") if not name.endswith((".tmp", ".lock"))
+        ]
+        kept, total = 0, 0
+        for name in sorted(rotated, key=os.path.getmtime, reverse=True):
+            size = os.path.getsize(name)
+            if (self.backupCount and kept >= self.backupCount) or (
+                self.max_total_bytes and total + size > self.max_total_bytes
+            ):
+                os.remove(name)
+            else:
+                kept, total = kept + 1, total + size
+
+    def close(self):
+        self.worker.shutdown(wait=True)
+        super().close()
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Put the records in a bounded queue, dropping them when the queue is full unless `block` is set. The number of
+    dropped records is logged as soon as the queue has room again.
+    """
+
+    def __init__(self, log_queue, block=False):
+        super().__init__(log_queue)
+        self.block = block
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if self.block:
+            self.queue.put(record)
+            return
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            summary = logging.makeLogRecord(
+                {
+                    "name": record.name,
+                    "levelno": logging.WARNING,
+                    "levelname": "WARNING",
+                    "msg": f"{dropped} log records dropped because the log queue was full",
+                }
+            )
+            try:
+                self.queue.put_nowait(summary)
+            except queue.Full:
+                self.dropped += dropped
 
 
 class Log:
+    # The handlers shared by every logger writing to the same file
+    handlers = {}
+    rate_limit_filter = RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_INTERVAL)
+    request_context_filter = RequestContextFilter()
+
     def __init__(self, logfile_name):
-        self.log_file_formatter = logging.Formatter("%(asctime)s %(levelname)-8s | %(message)s")
+        if LOG_FORMAT == "json":
+            self.log_file_formatter = JsonFormatter()
+        else:
+            self.log_file_formatter = logging.Formatter("%(asctime)s %(levelname)-8s | %(message)s")
         self.log_file = logfile_name
-        self.log_level = logging.DEBUG
+        self.log_level = LOG_LEVEL
 
     def get_console_handler(self):
         """
@@ -24,7 +312,7 @@ class Log:
         """
         console_handler = logging.StreamHandler(sys.stdout)
 
-        if is_colorlog_presented:
+        if is_colorlog_presented and LOG_FORMAT != "json":
             log_stream_format = " %(log_color)s%(asctime)s %(levelname)-8s%(reset)s | %(log_color)s%(message)s%(reset)s"
             # The available color names are 'black', 'red', 'green', 'yellow', 'blue', 'purple', 'cyan' and 'white'.
             log_stream_formatter = colorlog.ColoredFormatter(
@@ -49,22 +337,55 @@ class Log:
         :return: file_handler
         """
 
-        # Use RotatingFileHandler classes, such as the TimedRotatingFileHandler, instead of FileHandler, as it will
-        # rotate the file for you automatically when the file reaches a size limit or do it everyday.
-        file_handler = TimedRotatingFileHandler(
-            filename=datetime.datetime.now().strftime(self.log_file + "_%Y%m%d.log"), when="midnight"
+        # Rotate the file everyday or when it reaches a size limit, and archive the rotated files in the background.
+        file_handler = SizedTimedRotatingFileHandler(
+            filename=self.log_file + ".log",
+            max_bytes=LOG_MAX_BYTES,
+            backup_count=LOG_BACKUP_COUNT,
+            max_total_bytes=LOG_MAX_TOTAL_BYTES,
+            compress=LOG_COMPRESS,
         )
         file_handler.setFormatter(self.log_file_formatter)
         return file_handler
 
+    def get_handlers(self):
+        """
+        Get the handlers of the log file, created once and shared by its loggers: the console and file handlers, or
+        a queue handler feeding them from a background listener thread
+        :return: handlers
+        """
+        if self.log_file not in Log.handlers:
+            handlers = [self.get_console_handler(), self.get_file_handler()]
+            if LOG_QUEUE:
+                log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+                listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+                listener.start()
+                atexit.register(listener.stop)
+                handlers = [BoundedQueueHandler(log_queue, block=LOG_QUEUE_POLICY == "block")]
+            Log.handlers[self.log_file] = handlers
+
+        return Log.handlers[self.log_file]
+
     def get_logger(self, logger_name):
         logger = logging.getLogger(logger_name)
-        logger.setLevel(self.log_level)
-        logger.addHandler(self.get_console_handler())
-        logger.addHandler(self.get_file_handler())
+        logger.setLevel(LOG_LEVELS.get(logger_name, self.log_level))
+        if not logger.handlers:
+            for handler in self.get_handlers():
+                logger.addHandler(handler)
+            logger.addFilter(Log.rate_limit_filter)
+            if LOG_FORMAT == "json":
+                logger.addFilter(Log.request_context_filter)
         logger.propagate = False
         return logger
 
+    @staticmethod
+    def set_levels(levels):
+        """
+        Set the level of some loggers, from a dict of logger name to level name
+        """
+        for logger_name, level in levels.items():
+            logging.getLogger(logger_name).setLevel(level.upper())
+
         # _log = logging.getLogger("pythonConfig")
         # _log.setLevel(log_level)
         # _log.addHandler(file_handler)
@@ -3,6 +3,11 @@ import json
 import pytest
 from flask import session
 
+from app import db, hashing
+from app.generation import Generations, get_generations
+from app.models import Employee, EmployeeSnapshot, get_employee_cache
+from tests.conftest import get_url
+
 
 def test_signup_view(auth):
     """
@@ -78,3 +83,234 @@ def test_logout_with_login_before_view(auth):
     auth.login(dict(email="non-admin@admin.com", password="123456"))
     response = auth.logout()
     assert response.status_code == 200
+
+
+def test_authenticated_employee_is_cached(app, auth, client):
+    """
+    Test that the authenticated employee is loaded from the database once and then from the cache
+    """
+
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    target_url = get_url(app=app, url="user.list_employees")
+    assert client.get(target_url).status_code == 200
+    assert client.get(target_url).status_code == 200
+
+    stats = get_employee_cache().stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+    assert isinstance(get_employee_cache().get(1)[1], EmployeeSnapshot)
+
+
+def test_authenticated_employee_cache_invalidation(app, auth, client):
+    """
+    Test that a modified employee is dropped from the cache once the change is committed
+    """
+
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    target_url = get_url(app=app, url="user.list_employees")
+    assert client.get(target_url).status_code == 200
+
+    Employee.query.get(1).is_admin = False
+    db.session.commit()
+    assert client.get(target_url).status_code == 403
+
+
+def test_authenticated_employee_cache_follows_other_workers(app, auth, client):
+    """
+    Test that a cached employee is reloaded once another worker changed the employees
+    """
+
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    target_url = get_url(app=app, url="user.list_employees")
+    assert client.get(target_url).status_code == 200
+
+    db.session.execute(Employee.__table__.update().where(Employee.id == 1).values(is_admin=False))
+    db.session.commit()
+    assert client.get(target_url).status_code == 200
+
+    Generations(get_generations().path).bump("employees")
+    assert client.get(target_url).status_code == 403
+
+
+def test_employee_snapshot_is_immutable():
+    """
+    Test that an employee snapshot cannot be changed
+    """
+
+    employee = EmployeeSnapshot(1, "admin", True)
+    with pytest.raises(AttributeError):
+        employee.is_admin = False
+    assert employee.get_id() == "1"
+
+
+def test_login_with_token_view(app, auth, client):
+    """
+    Test that a login in token mode returns signed tokens that authenticate requests without a session
+    """
+
+    response = auth.login(dict(email="admin@admin.com", password="123456", token=True))
+    data = json.loads(response.data)
+    assert response.status_code == 200
+    assert data["token_type"] == "Bearer"
+
+    with client:
+        client.get("/")
+        assert "_user_id" not in session
+
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+    target_url = get_url(app=app, url="user.list_employees")
+    assert client.get(target_url, headers=headers).status_code == 200
+    assert get_employee_cache().stats()["misses"] == 0
+
+
+def test_login_with_invalid_token_view(app, client):
+    """
+    Test that a request with an invalid or expired access token is unauthorized
+    """
+
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    response = client.get(target_url, headers={"Authorization": "Bearer not-a-token"})
+    assert response.status_code == 401
+    assert b"Invalid access token." in response.data
+
+
+def test_refresh_token_view(app, auth, client):
+    """
+    Test that a refresh token can be exchanged for new tokens, but an access token cannot
+    """
+
+    data = json.loads(auth.login(dict(email="non-admin@admin.com", password="123456", token=True)).data)
+    target_url = get_url(app=app, url="auth.refresh_token")
+    response = auth.generic_post(target_url, dict(refresh_token=data["refresh_token"]))
+    assert response.status_code == 200
+    assert json.loads(response.data)["access_token"]
+
+    response = auth.generic_post(target_url, dict(refresh_token=data["access_token"]))
+    assert response.status_code == 401
+    assert auth.generic_post(target_url, dict()).status_code == 400
+
+
+def test_login_rehashes_password_view(app, auth):
+    """
+    Test that the password is hashed again on login when the configured work factor changed
+    """
+
+    app.config.update(PASSWORD_HASH_ITERATIONS=2000)
+    assert hashing.needs_rehash(Employee.query.get(2).password_hash)
+
+    response = auth.login(dict(email="non-admin@admin.com", password="123456"))
+    assert response.status_code == 200
+    assert Employee.query.get(2).password_hash.startswith("pbkdf2:sha256:2000$")
+    assert auth.login(dict(email="non-admin@admin.com", password="123456")).status_code == 200
+
+
+def test_password_hashing_pool(app):
+    """
+    Test that passwords are hashed and checked on the process pool
+    """
+
+    app.config.update(PASSWORD_HASH_WORKERS=1)
+    password_hash = hashing.hash_password("123456")
+    assert hashing.check_password(password_hash, "123456")
+    assert not hashing.check_password(password_hash, "654321")
+
+    app.config.update(PASSWORD_HASH_WORKERS=2)
+    assert hashing.get_pool().workers == 2
+    assert hashing.check_password(password_hash, "123456")
+
+
+def test_password_hashing_pool_saturated_view(app, auth):
+    """
+    Test that a login is refused with 503 when the password hashing pool is saturated
+    """
+
+    app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_MAX_PENDING=1)
+    hashing.get_pool().slots.acquire()
+    response = auth.login(dict(email="non-admin@admin.com", password="123456"))
+    assert response.status_code == 503
+
+
+def test_bulk_signup_with_login_non_admin_view(app, auth):
+    """
+    Test that a bulk sign up cannot be done by a non-admin user
+    """
+
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    response = auth.generic_post(get_url(app=app, url="auth.bulk_signup"), [])
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize("workers", (0, 2))
+def test_bulk_signup_view(app, auth, workers):
+    """
+    Test that many employees can be signed up at once, with a result for each of them
+    """
+
+    app.config.update(PASSWORD_HASH_WORKERS=workers)
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    employees = [
+        dict(email="a@test.com", username="a", first_name="A", last_name="A", password="123456"),
+        dict(email="admin@admin.com", username="b", first_name="B", last_name="B", password="123456"),
+        dict(email="c@test.com", username="c", first_name="C", last_name="C"),
+        dict(email="d@test.com", username="a", first_name="D", last_name="D", password="123456"),
+        dict(email="e@test.com", username="e", first_name="E", last_name="E", password="654321", is_admin=True),
+    ]
+    response = auth.generic_post(get_url(app=app, url="auth.bulk_signup"), employees)
+    data = json.loads(response.data)
+    assert response.status_code == 200
+    assert [result["status"] for result in data["results"]] == ["created", "error", "error", "error", "created"]
+    assert data["results"][1]["error"] == "admin@admin.com is already in use."
+    assert data["created"] == 2
+
+    auth.logout()
+    assert auth.login(dict(email="e@test.com", password="654321")).status_code == 200
+    assert Employee.query.filter_by(username="e").first().is_admin
+
+
+def test_bulk_signup_is_admin_must_be_a_boolean_view(app, auth):
+    """
+    Test that a bulk sign up only accepts a JSON boolean as admin flag, so "false" does not make an admin
+    """
+
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    employees = [
+        dict(email="a@test.com", username="a", first_name="A", last_name="A", password="123456", is_admin="false"),
+        dict(email="b@test.com", username="b", first_name="B", last_name="B", password="123456", is_admin=1),
+        dict(email="c@test.com", username="c", first_name="C", last_name="C", password="123456", is_admin=False),
+    ]
+    data = json.loads(auth.generic_post(get_url(app=app, url="auth.bulk_signup"), employees).data)
+    assert [result["status"] for result in data["results"]] == ["error", "error", "created"]
+    assert data["results"][0]["error"] == "The value of 'is_admin' must be true or false."
+    assert Employee.query.filter_by(username="a").first() is None
+    assert not Employee.query.filter_by(username="c").first().is_admin
+
+
+def test_bulk_signup_invalid_values_view(app, auth):
+    """
+    Test that a bulk sign up reports the rows with values that are not texts, or too long, as errors
+    """
+
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    employees = [
+        dict(email=["a@test.com"], username="a", first_name="A", last_name="A", password="123456"),
+        dict(email="b@test.com", username="b", first_name="B", last_name="B", password=123456),
+        dict(email="c@test.com", username="c" * 61, first_name="C", last_name="C", password="123456"),
+        dict(email="d@test.com", username="d", first_name="D", last_name="D", password="123456"),
+    ]
+    data = json.loads(auth.generic_post(get_url(app=app, url="auth.bulk_signup"), employees).data)
+    assert [result["status"] for result in data["results"]] == ["error", "error", "error", "created"]
+    assert data["results"][0]["error"] == "The value of 'email' must be a text."
+    assert data["results"][1]["error"] == "The value of 'password' must be a text."
+    assert data["results"][2]["error"] == "The value of 'username' must be at most 60 characters long."
+
+
+def test_bulk_signup_invalid_request_view(app, auth):
+    """
+    Test that a bulk sign up needs an array of employees
+    """
+
+    app.config.update(EMPLOYEES_BULK_MAX_ITEMS=1)
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    target_url = get_url(app=app, url="auth.bulk_signup")
+    assert auth.generic_post(target_url, dict(email="a@test.com")).status_code == 400
+    assert auth.generic_post(target_url, [{}, {}]).status_code == 400
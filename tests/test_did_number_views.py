@@ -1,6 +1,29 @@
+import io
+import json
+import threading
+import time
+
+import pytest
 from flask import redirect
 
-from tests.conftest import get_url
+from app import db
+from app.cache import get_cache
+from app.generation import Generations, get_generations
+from app.indexes import PrefixIndex
+from app.models import DidNumber
+from app.singleflight import SingleFlight
+from app.user import views
+from tests.conftest import AuthActions, get_url, json_of_response
+
+
+def populate_did_number_prices():
+    """
+    Add DID numbers with different currencies and prices
+    """
+
+    for i, monthly_price in enumerate((1.0, 2.0, 3.0), start=1):
+        db.session.add(DidNumber(value=f"+1 555 000{i}", monthly_price=monthly_price, setup_price=1, currency="EUR"))
+    db.session.commit()
 
 
 def test_list_did_numbers_without_login_view(app, client):
@@ -26,6 +49,428 @@ def test_list_did_numbers_with_login_view(app, auth, client):
     assert response.status_code == 200
 
 
+def test_list_did_numbers_offset_pagination_view(app, auth, client):
+    """
+    Test list DID numbers using start/limit pagination
+    """
+
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    data = json_of_response(client.get(target_url + "?start=2&limit=1"))
+    assert data["count"] == 2
+    assert data["previous"] == target_url + "?start=1&limit=1"
+    assert data["next"] == ""
+    assert [did_number["id"] for did_number in data["results"]] == [2]
+
+
+@pytest.mark.parametrize("params", ("start=0", "start=-5", "start=abc", "limit=abc", "limit=0", "limit=-1"))
+def test_list_did_numbers_invalid_pagination_view(app, auth, client, params):
+    """
+    Test list DID numbers with an invalid start or limit
+    """
+
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    assert client.get(target_url + "?" + params).status_code == 400
+
+
+def test_list_did_numbers_limit_is_capped_view(app, auth, client):
+    """
+    Test that the page size of the offset pagination is bounded by PAGINATION_MAX_LIMIT
+    """
+
+    app.config.update(PAGINATION_MAX_LIMIT=1)
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    data = json_of_response(client.get(target_url + "?limit=100000"))
+    assert data["limit"] == 1
+    assert len(data["results"]) == 1
+    assert data["next"] == target_url + "?start=2&limit=1"
+
+
+def test_list_did_numbers_cursor_pagination_view(app, auth, client):
+    """
+    Test list DID numbers using cursor pagination, forward and backward
+    """
+
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    first_page = json_of_response(client.get(target_url + "?after=&limit=1"))
+    assert [did_number["id"] for did_number in first_page["results"]] == [1]
+    assert first_page["previous"] == ""
+
+    second_page = json_of_response(client.get(first_page["next"]))
+    assert [did_number["id"] for did_number in second_page["results"]] == [2]
+    assert second_page["next"] == ""
+
+    previous_page = json_of_response(client.get(second_page["previous"]))
+    assert [did_number["id"] for did_number in previous_page["results"]] == [1]
+    assert previous_page["previous"] == ""
+
+
+def test_list_did_numbers_invalid_cursor_view(app, auth, client):
+    """
+    Test list DID numbers using a cursor that cannot be decoded
+    """
+
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    response = client.get(target_url + "?after=not-a-cursor")
+    assert response.status_code == 400
+
+
+def test_list_did_numbers_filter_and_sort_view(app, auth, client):
+    """
+    Test list DID numbers filtered and sorted in SQL, keeping the filters in the page urls
+    """
+
+    populate_did_number_prices()
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    data = json_of_response(client.get(target_url + "?currency=EUR&sort=monthly_price&order=desc&limit=2"))
+    assert data["count"] == 3
+    assert [did_number["monthly_price"] for did_number in data["results"]] == [3.0, 2.0]
+    assert data["next"] == target_url + "?currency=EUR&sort=monthly_price&order=desc&start=3&limit=2"
+
+    data = json_of_response(client.get(target_url + "?prefix=%2B1&max_monthly_price=2"))
+    assert [did_number["value"] for did_number in data["results"]] == ["+1 555 0001", "+1 555 0002"]
+
+
+def test_list_did_numbers_sorted_cursor_pagination_view(app, auth, client):
+    """
+    Test list DID numbers with cursor pagination on a sort column other than the id
+    """
+
+    populate_did_number_prices()
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    data = json_of_response(client.get(target_url + "?after=&sort=monthly_price&order=desc&limit=2"))
+    seen = [did_number["monthly_price"] for did_number in data["results"]]
+    while data["next"]:
+        data = json_of_response(client.get(data["next"]))
+        seen += [did_number["monthly_price"] for did_number in data["results"]]
+    assert seen == [3.0, 2.0, 1.0, 0.06, 0.06]
+
+    data = json_of_response(client.get(data["previous"]))
+    assert [did_number["monthly_price"] for did_number in data["results"]] == [1.0, 0.06]
+
+
+@pytest.mark.parametrize("order", ("asc", "desc"))
+def test_list_did_numbers_sorted_cursor_pagination_with_nulls_view(app, auth, client, order):
+    """
+    Test that cursor pagination on a sort column lists the rows where it is NULL, in the order of offset pagination
+    """
+
+    populate_did_number_prices()
+    DidNumber.query.filter(DidNumber.id.in_([2, 4])).update({"monthly_price": None}, synchronize_session=False)
+    db.session.commit()
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    expected = [
+        did_number["id"]
+        for did_number in json_of_response(client.get(target_url + f"?sort=monthly_price&order={order}"))["results"]
+    ]
+
+    data = json_of_response(client.get(target_url + f"?after=&sort=monthly_price&order={order}&limit=2"))
+    pages = [[did_number["id"] for did_number in data["results"]]]
+    while data["next"]:
+        data = json_of_response(client.get(data["next"]))
+        pages.append([did_number["id"] for did_number in data["results"]])
+    assert sum(pages, []) == expected
+
+    while data["previous"]:
+        data = json_of_response(client.get(data["previous"]))
+        assert [did_number["id"] for did_number in data["results"]] == pages[-2]
+        pages.pop()
+
+
+def test_list_did_numbers_empty_filter_view(app, auth, client):
+    """
+    Test that a filter matching no DID number gives an empty first page, whatever the pagination, and only the pages
+    past it are not found
+    """
+
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    for query_string in ("?currency=XYZ", "?currency=XYZ&count=none", "?currency=XYZ&after="):
+        response = client.get(target_url + query_string)
+        assert response.status_code == 200
+        assert json_of_response(response)["results"] == []
+        assert json_of_response(response)["next"] == ""
+
+    assert client.get(target_url + "?currency=XYZ&start=2").status_code == 404
+
+
+def test_list_did_numbers_invalid_sort_view(app, auth, client):
+    """
+    Test list DID numbers with an invalid sort column or order
+    """
+
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    assert client.get(target_url + "?sort=password").status_code == 400
+    assert client.get(target_url + "?order=up").status_code == 400
+
+
+@pytest.mark.parametrize(
+    ("query_string", "count", "has_next"),
+    (
+        ("?currency=EUR", 3, True),
+        ("?currency=EUR&max_monthly_price=2", 2, False),
+        ("?currency=EUR&max_monthly_price=2&count=estimated", 3, False),
+        ("?count=exact", 5, True),
+        ("?count=none", None, True),
+    ),
+)
+def test_list_did_numbers_count_modes_view(app, auth, client, query_string, count, has_next):
+    """
+    Test list DID numbers with the maintained counters, an exact count of a filter or no count
+    """
+
+    populate_did_number_prices()
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    data = json_of_response(client.get(target_url + query_string + "&limit=2"))
+    assert data["count"] == count
+    assert bool(data["next"]) == has_next
+
+
+def test_list_did_numbers_estimated_count_of_a_filter_view(app, auth, client):
+    """
+    Test that an estimated count, which ignores a filter, does not link to pages past the filtered DID numbers
+    """
+
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    data = json_of_response(client.get(target_url + "?prefix=%2B55 84 91234-4320&count=estimated&limit=1"))
+    assert data["count"] == 2
+    assert [did_number["id"] for did_number in data["results"]] == [1]
+    assert data["next"] == ""
+    assert client.get(target_url + "?prefix=%2B55 84 91234-4320&count=estimated&start=2&limit=1").status_code == 404
+
+
+def test_list_did_numbers_counts_after_bulk_writes_view(app, auth, client):
+    """
+    Test that the maintained counters follow the batch, bulk edit and bulk delete writes
+    """
+
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    items = [dict(value="+1 555 0001", monthlyPrice=1, setupPrice=1, currency="EUR")]
+    auth.generic_post(get_url(app=app, url="user.batch_didnumbers"), items)
+    assert json_of_response(client.get(target_url + "?currency=EUR"))["count"] == 1
+
+    a_dict = dict(ids=[1, 3], set=dict(currency="BRL"))
+    auth.generic_put(get_url(app=app, url="user.bulk_edit_did_numbers"), a_dict)
+    assert json_of_response(client.get(target_url + "?currency=BRL"))["count"] == 2
+    assert json_of_response(client.get(target_url + "?currency=EUR"))["count"] == 0
+
+    a_dict = dict(filter=dict(currency="BRL"))
+    target_url = get_url(app=app, url="user.bulk_delete_did_numbers")
+    client.delete(target_url, data=json.dumps(a_dict), content_type="application/json")
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    assert json_of_response(client.get(target_url))["count"] == 1
+
+
+def test_multi_get_did_numbers_view(app, auth, client):
+    """
+    Test get many DID numbers by id, in the requested order and with the missing ids
+    """
+
+    app.config.update(DIDNUMBERS_IN_CHUNK_SIZE=1)
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    data = json_of_response(client.get(target_url + "?ids=2,1000,1"))
+    assert [did_number["id"] for did_number in data["results"]] == [2, 1]
+    assert data["missing"] == [1000]
+
+    data = json_of_response(auth.generic_post(target_url, dict(ids=[1, 2])))
+    assert [did_number["id"] for did_number in data["results"]] == [1, 2]
+    assert data["missing"] == []
+
+
+def test_multi_get_did_numbers_invalid_request_view(app, auth, client):
+    """
+    Test get many DID numbers with invalid ids, no ids or too many ids
+    """
+
+    app.config.update(DIDNUMBERS_MULTI_GET_MAX_IDS=2)
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    assert client.get(target_url + "?ids=1,a").status_code == 400
+    assert auth.generic_post(target_url, dict()).status_code == 400
+    assert client.get(target_url + "?ids=1,2,3").status_code == 400
+
+
+def test_export_did_numbers_without_login_view(app, client):
+    """
+    Test export DID numbers without login (a redirection should be done)
+    """
+
+    target_url = get_url(app=app, url="user.export_didnumbers")
+    response = client.get(target_url)
+    assert response.status_code == 302
+
+
+def test_export_did_numbers_ndjson_view(app, auth, client):
+    """
+    Test export DID numbers as NDJSON, reading the table in chunks
+    """
+
+    app.config.update(DIDNUMBERS_EXPORT_CHUNK_SIZE=1)
+    target_url = get_url(app=app, url="user.export_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    response = client.get(target_url)
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.data.decode("utf8").splitlines()]
+    assert [row["value"] for row in rows] == ["+55 84 91234-4320", "+55 84 91234-4321"]
+
+
+def test_export_did_numbers_csv_with_filters_view(app, auth, client):
+    """
+    Test export DID numbers as CSV using currency and price filters
+    """
+
+    target_url = get_url(app=app, url="user.export_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    response = client.get(target_url + "?format=csv&currency=U$&min_monthly_price=0.01&max_setup_price=5")
+    lines = response.data.decode("utf8").splitlines()
+    assert lines[0] == "id,value,monthly_price,setup_price,currency"
+    assert len(lines) == 3
+
+    response = client.get(target_url + "?format=csv&currency=EUR")
+    assert len(response.data.decode("utf8").splitlines()) == 1
+
+
+def test_export_did_numbers_invalid_format_view(app, auth, client):
+    """
+    Test export DID numbers using a format that is not supported
+    """
+
+    target_url = get_url(app=app, url="user.export_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    assert client.get(target_url + "?format=xml").status_code == 400
+    assert client.get(target_url + "?min_monthly_price=abc").status_code == 400
+
+
+def wait_for_job(client, url):
+    """
+    Poll a background job until it is done
+    """
+
+    for _ in range(100):
+        data = json_of_response(client.get(url))
+        if data["status"] in ("finished", "failed"):
+            return data
+        time.sleep(0.05)
+
+    raise AssertionError(f"Job {url} did not finish")
+
+
+def test_import_did_numbers_without_login_view(app, client):
+    """
+    Test import DID numbers without login (a redirection should be done)
+    """
+
+    target_url = get_url(app=app, url="user.import_didnumbers")
+    response = client.post(target_url)
+    assert response.status_code == 302
+
+
+def test_import_did_numbers_csv_view(app, auth, client):
+    """
+    Test import DID numbers from a CSV upload, reporting duplicated and invalid rows with their line numbers
+    """
+
+    app.config.update(DIDNUMBERS_IMPORT_BATCH_SIZE=2)
+    target_url = get_url(app=app, url="user.import_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    content = (
+        "value,monthlyPrice,setupPrice,currency\n"
+        "+55 84 91234-1000,0.06,3.49,U$\n"
+        "+55 84 91234-4320,0.06,3.49,U$\n"
+        "+55 84 91234-1001,abc,3.49,U$\n"
+        "+55 84 91234-1002,0.06,3.49,U$\n"
+        "+55 84 91234-1000,0.06,3.49,U$\n"
+    )
+    response = client.post(
+        target_url,
+        data={"file": (io.BytesIO(content.encode("utf8")), "numbers.csv")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 202
+
+    data = wait_for_job(client, json_of_response(response)["url"])
+    assert data["status"] == "finished"
+    assert data["result"]["inserted"] == 2
+    assert [error["line"] for error in data["result"]["errors"]] == [3, 4, 6]
+
+
+def test_import_did_numbers_ndjson_view(app, auth, client):
+    """
+    Test import DID numbers from a raw NDJSON body
+    """
+
+    target_url = get_url(app=app, url="user.import_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    content = '{"value": "+55 84 91234-2000", "monthlyPrice": 1, "setupPrice": 2, "currency": "EUR"}\n{not json}\n'
+    response = client.post(target_url + "?format=ndjson", data=content, content_type="application/x-ndjson")
+    data = wait_for_job(client, json_of_response(response)["url"])
+    assert data["result"]["inserted"] == 1
+    assert data["result"]["errors"][0]["line"] == 2
+
+
+def test_import_did_numbers_status_from_another_worker_view(app, auth, client):
+    """
+    Test the status of an import is kept in the database, so a worker that did not run the job can report it
+    """
+
+    target_url = get_url(app=app, url="user.import_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    content = "value,monthlyPrice,setupPrice,currency\n+55 84 91234-3000,0.06,3.49,U$\n"
+    response = client.post(target_url + "?format=csv", data=content, content_type="text/csv")
+    status_url = json_of_response(response)["url"]
+    wait_for_job(client, status_url)
+
+    app.extensions.pop("jobs")
+    data = json_of_response(client.get(status_url))
+    assert data["status"] == "finished"
+    assert data["result"]["inserted"] == 1
+
+
+def test_import_did_numbers_invalid_format_view(app, auth, client):
+    """
+    Test import DID numbers using a format that is not supported
+    """
+
+    target_url = get_url(app=app, url="user.import_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    response = client.post(target_url + "?format=xml", data="")
+    assert response.status_code == 400
+
+
+def test_import_did_numbers_status_that_does_not_exist_view(app, auth, client):
+    """
+    Test import status of a job that does not exist
+    """
+
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    response = client.get(get_url(app=app, url="user.import_didnumbers") + "/unknown")
+    assert response.status_code == 404
+
+
+def test_import_did_numbers_command(app, runner, tmp_path):
+    """
+    Test import DID numbers using the flask command
+    """
+
+    path = tmp_path / "numbers.ndjson"
+    path.write_text('{"value": "+55 84 91234-3000", "monthly_price": 1, "setup_price": 2, "currency": "EUR"}\n')
+    result = runner.invoke(args=["import-didnumbers", str(path)])
+    assert "1 inserted, 0 errors" in result.output
+
+
 def test_detail_did_numbers_without_login_view(app, client):
     """
     Test detail DID numbers without login (a redirection should be done)
@@ -49,6 +494,131 @@ def test_detail_did_numbers_with_login_view(app, auth, client):
     assert response.status_code == 200
 
 
+def test_detail_did_number_conditional_view(app, auth, client):
+    """
+    Test that a DID number detail is not sent again while it has not changed
+    """
+
+    target_url = get_url(app=app, url="user.didnumber_detail", id=1)
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    response = client.get(target_url)
+    etag, last_modified = response.headers["ETag"], response.headers["Last-Modified"]
+
+    response = client.get(target_url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert client.get(target_url, headers={"If-Modified-Since": last_modified}).status_code == 304
+
+    a_dict = dict(value="+55 84 91234-4329", monthlyPrice="0.06", setupPrice="3.49", currency="U$")
+    auth.generic_put(get_url(app=app, url="user.edit_did_number", id=1), a_dict)
+    response = client.get(target_url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_list_did_numbers_conditional_view(app, auth, client):
+    """
+    Test that a DID numbers listing is not sent again until a DID number is written
+    """
+
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    etag = client.get(target_url).headers["ETag"]
+    assert client.get(target_url + "?limit=1", headers={"If-None-Match": etag}).status_code == 304
+
+    client.delete(get_url(app=app, url="user.delete_did_number", id=2))
+    response = client.get(target_url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert json_of_response(response)["count"] == 1
+
+
+def test_list_did_numbers_cached_view(app, auth, client):
+    """
+    Test that a DID numbers listing is cached until a DID number is written, by this or another worker
+    """
+
+    target_url = get_url(app=app, url="user.list_didnumbers") + "?limit=1"
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    assert json_of_response(client.get(target_url))["results"][0]["currency"] == "U$"
+
+    db.session.execute(DidNumber.__table__.update().values(currency="EUR"))
+    db.session.commit()
+    assert json_of_response(client.get(target_url))["results"][0]["currency"] == "U$"
+    assert get_cache("responses", 1, 1).stats()["hits"] == 1
+
+    Generations(get_generations().path).bump("didnumbers")
+    assert json_of_response(client.get(target_url))["results"][0]["currency"] == "EUR"
+
+
+def test_list_did_numbers_coalesced_view(app, auth, monkeypatch):
+    """
+    Test that identical concurrent requests for a DID numbers listing run the listing once and share its response
+    """
+
+    app.config.update(RESPONSE_CACHE_SIZE=0)
+    calls, started = [], threading.Event()
+    get_paginated_list = views.get_paginated_list
+
+    def slow_get_paginated_list(**kwargs):
+        calls.append(kwargs)
+        started.set()
+        time.sleep(0.2)
+        return get_paginated_list(**kwargs)
+
+    monkeypatch.setattr(views, "get_paginated_list", slow_get_paginated_list)
+    target_url = get_url(app=app, url="user.list_didnumbers")
+    clients = [app.test_client() for _ in range(4)]
+    for client in clients:
+        AuthActions(app, client).login(dict(email="non-admin@admin.com", password="123456"))
+
+    responses = []
+    leader = threading.Thread(target=lambda: responses.append(clients[0].get(target_url)))
+    leader.start()
+    started.wait(5)
+    waiters = [threading.Thread(target=lambda c=client: responses.append(c.get(target_url))) for client in clients[1:]]
+    for thread in waiters:
+        thread.start()
+    for thread in [leader, *waiters]:
+        thread.join()
+
+    assert len(calls) == 1
+    assert [response.status_code for response in responses] == [200] * 4
+    assert len({response.data for response in responses}) == 1
+
+
+def test_single_flight_propagates_failures():
+    """
+    Test that the failure of a coalesced call is raised to every caller waiting for it
+    """
+
+    flight, started, calls, results = SingleFlight(), threading.Event(), [], []
+
+    def fail():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        raise ValueError("failed")
+
+    def call():
+        try:
+            flight.do("key", fail)
+        except ValueError as e:
+            results.append(str(e))
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    started.wait(5)
+    threads += [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ["failed"] * 4
+    assert flight.calls == {}
+
+
 def test_detail_did_number_that_does_not_exist_view(app, auth, client):
     """
     Test detail DID number that does not exist
@@ -60,6 +630,213 @@ def test_detail_did_number_that_does_not_exist_view(app, auth, client):
     assert response.status_code == 404
 
 
+def test_did_number_by_value_without_login_view(app, client):
+    """
+    Test get a DID number by value without login (a redirection should be done)
+    """
+
+    response = client.get("/didnumbers/by-value/+55 84 91234-4320")
+    assert response.status_code == 302
+
+
+def test_did_number_by_value_view(app, auth, client):
+    """
+    Test get a DID number by value, with an unnormalized value and from the cache
+    """
+
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    response = client.get("/didnumbers/by-value/ +55  84 91234-4320 ")
+    assert response.status_code == 200
+    assert json_of_response(response)["id"] == 1
+
+    response = client.get("/didnumbers/by-value/+55 84 91234-4320")
+    assert json_of_response(response)["id"] == 1
+    assert client.get("/didnumbers/by-value/+55 84 91234-9999").status_code == 404
+
+
+def test_did_number_by_value_compact_view(app, auth, client):
+    """
+    Test get a DID number by the compact form of its value
+    """
+
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    target_url = get_url(app=app, url="user.edit_did_number", id=2)
+    a_dict = dict(value="+5584912344321", monthlyPrice="0.06", setupPrice="3.49", currency="U$")
+    auth.generic_put(target_url, a_dict)
+    response = client.get("/didnumbers/by-value/+55 84 91234-4321")
+    assert json_of_response(response)["id"] == 2
+
+
+def test_did_number_by_value_in_any_format_view(app, auth, client):
+    """
+    Test get a DID number stored formatted by its value without formatting, with or without the "+"
+    """
+
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    assert json_of_response(client.get("/didnumbers/by-value/+5584912344320"))["id"] == 1
+    assert json_of_response(client.get("/didnumbers/by-value/5584912344320"))["id"] == 1
+    assert client.get("/didnumbers/by-value/abc").status_code == 404
+
+
+def test_did_number_by_value_cache_invalidation_view(app, auth, client):
+    """
+    Test that the cached lookups by value are dropped when a DID number is edited or deleted
+    """
+
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    assert client.get("/didnumbers/by-value/+55 84 91234-4320").status_code == 200
+
+    target_url = get_url(app=app, url="user.edit_did_number", id=1)
+    a_dict = dict(value="+55 84 91234-4320", monthlyPrice="1.5", setupPrice="3.49", currency="U$")
+    auth.generic_put(target_url, a_dict)
+    response = client.get("/didnumbers/by-value/+55 84 91234-4320")
+    assert json_of_response(response)["monthly_price"] == 1.5
+
+    client.delete(get_url(app=app, url="user.delete_did_number", id=1))
+    assert client.get("/didnumbers/by-value/+55 84 91234-4320").status_code == 404
+
+
+def test_did_number_by_value_follows_other_workers_view(app, auth, client):
+    """
+    Test that the cached lookups by value are dropped once another worker wrote DID numbers
+    """
+
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    assert client.get("/didnumbers/by-value/5584912344320").status_code == 200
+
+    db.session.execute(DidNumber.__table__.delete().where(DidNumber.id == 1))
+    db.session.commit()
+    assert client.get("/didnumbers/by-value/5584912344320").status_code == 200
+
+    Generations(get_generations().path).bump("didnumbers")
+    assert client.get("/didnumbers/by-value/5584912344320").status_code == 404
+
+
+def test_did_numbers_by_prefix_view(app, auth, client):
+    """
+    Test list DID numbers by prefix, page by page
+    """
+
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    first_page = json_of_response(client.get("/didnumbers/prefix/+55 84?limit=1"))
+    assert [did_number["id"] for did_number in first_page["results"]] == [1]
+
+    second_page = json_of_response(client.get(first_page["next"]))
+    assert [did_number["id"] for did_number in second_page["results"]] == [2]
+    assert second_page["next"] == ""
+
+    assert json_of_response(client.get("/didnumbers/prefix/1"))["results"] == []
+    assert client.get("/didnumbers/prefix/abc").status_code == 400
+
+
+def test_prefix_index_add_is_idempotent():
+    """
+    Test that adding a pair already in the prefix index (e.g. read by a rebuild before its write is applied) keeps it
+    once
+    """
+
+    index = PrefixIndex()
+    index.build([("5584", 1)])
+    index.add("5584", 1)
+    assert index.search("55", 10) == [("5584", 1)]
+    assert index.ids_by_key == {"5584": [1]}
+
+
+def test_did_number_longest_match_view(app, auth, client):
+    """
+    Test rate a dialed number with the longest prefix match, following added and deleted DID numbers
+    """
+
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    assert client.get("/didnumbers/match/+1 555").status_code == 404
+    a_dict = dict(value="+55 84", monthlyPrice="1.0", setupPrice="2.0", currency="U$")
+    auth.generic_post(get_url(app=app, url="user.add_didnumber"), a_dict)
+
+    data = json_of_response(client.get("/didnumbers/match/+55 84 99999-0000"))
+    assert data["prefix"] == "5584"
+    assert data["did_number"]["monthly_price"] == 1.0
+
+    data = json_of_response(client.get("/didnumbers/match/5584912344320"))
+    assert data["did_number"]["id"] == 1
+
+    client.delete(get_url(app=app, url="user.delete_did_number", id=3))
+    assert client.get("/didnumbers/match/+55 84 99999-0000").status_code == 404
+
+
+def test_search_did_numbers_view(app, auth, client):
+    """
+    Test search DID numbers by a substring or a wildcard pattern of their digits, page by page
+    """
+
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    target_url = get_url(app=app, url="user.search_didnumbers")
+
+    def results(pattern):
+        return [
+            did_number["id"]
+            for did_number in json_of_response(client.get(target_url + "?pattern=" + pattern))["results"]
+        ]
+
+    assert results("4320") == [1]
+    assert results("91234-43") == [1, 2]
+    assert results("*4321") == [2]
+    assert results("55?4*") == [1, 2]
+    assert results("55?4") == []
+    assert results("21") == [2]
+    assert results("777") == []
+
+    first_page = json_of_response(client.get(target_url + "?pattern=912&limit=1"))
+    assert [did_number["id"] for did_number in first_page["results"]] == [1]
+    second_page = json_of_response(client.get(first_page["next"]))
+    assert [did_number["id"] for did_number in second_page["results"]] == [2]
+    assert second_page["next"] == ""
+
+    assert client.get(target_url + "?pattern=*").status_code == 400
+
+
+def test_search_did_numbers_follows_writes_view(app, auth, client):
+    """
+    Test that the pattern search follows added, edited and deleted DID numbers
+    """
+
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    target_url = get_url(app=app, url="user.search_didnumbers") + "?pattern=7777"
+    assert json_of_response(client.get(target_url))["results"] == []
+
+    a_dict = dict(value="+55 84 97777-0000", monthlyPrice="1.0", setupPrice="2.0", currency="U$")
+    auth.generic_post(get_url(app=app, url="user.add_didnumber"), a_dict)
+    assert [did_number["id"] for did_number in json_of_response(client.get(target_url))["results"]] == [3]
+
+    a_dict = dict(value="+55 84 98888-0000", monthlyPrice="1.0", setupPrice="2.0", currency="U$")
+    auth.generic_put(get_url(app=app, url="user.edit_did_number", id=3), a_dict)
+    assert json_of_response(client.get(target_url))["results"] == []
+
+    client.delete(get_url(app=app, url="user.delete_did_number", id=3))
+    assert json_of_response(client.get(target_url.replace("7777", "8888")))["results"] == []
+
+
+def test_search_did_numbers_follows_other_workers_view(app, auth, client):
+    """
+    Test that the pattern search index is updated in place by the writes of this worker and rebuilt after the writes
+    of another one
+    """
+
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    target_url = get_url(app=app, url="user.search_didnumbers") + "?pattern=7777"
+    assert json_of_response(client.get(target_url))["results"] == []
+    built_at = app.extensions["didnumbers-ngram-index"].built_at
+
+    a_dict = dict(value="+55 84 97777-0000", monthlyPrice="1.0", setupPrice="2.0", currency="U$")
+    auth.generic_post(get_url(app=app, url="user.add_didnumber"), a_dict)
+    assert [did_number["id"] for did_number in json_of_response(client.get(target_url))["results"]] == [3]
+    assert app.extensions["didnumbers-ngram-index"].built_at == built_at
+
+    db.session.execute(DidNumber.__table__.insert().values(value="+55 84 97777-0001", currency="U$"))
+    db.session.commit()
+    Generations(get_generations().path).bump("didnumbers")
+    assert [did_number["id"] for did_number in json_of_response(client.get(target_url))["results"]] == [3, 4]
+
+
 def test_add_did_numbers_without_login_view(app, client):
     """
     Test add DID numbers without login (a redirection should be done)
@@ -107,6 +884,18 @@ def test_add_did_number_that_already_exists_view(app, auth, client):
     assert response.status_code == 403
 
 
+def test_add_did_number_that_already_exists_in_another_format_view(app, auth, client):
+    """
+    Test add DID number that already exists with another formatting
+    """
+
+    target_url = get_url(app=app, url="user.add_didnumber")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    a_dict = dict(value="+5584912344320", monthlyPrice="0.06", setupPrice="3.49", currency="U$")
+    response = auth.generic_post(target_url, a_dict)
+    assert response.status_code == 403
+
+
 #
 # def test_add_invalid_did_number_view(app, auth, client):
 #     """
@@ -125,6 +914,76 @@ def test_add_did_number_that_already_exists_view(app, auth, client):
 #     assert response.status_code == 500
 
 
+def test_batch_did_numbers_without_login_view(app, client):
+    """
+    Test batch DID numbers without login (a redirection should be done)
+    """
+
+    target_url = get_url(app=app, url="user.batch_didnumbers")
+    response = client.post(target_url)
+    assert response.status_code == 302
+
+
+@pytest.mark.parametrize(
+    ("mode", "status", "monthly_price"),
+    (
+        ("insert", "error", 0.06),
+        ("skip-existing", "skipped", 0.06),
+        ("upsert", "updated", 0.5),
+    ),
+)
+def test_batch_did_numbers_view(app, auth, client, mode, status, monthly_price):
+    """
+    Test batch DID numbers, with an existing value handled according to the mode
+    """
+
+    app.config.update(DIDNUMBERS_BATCH_CHUNK_SIZE=2)
+    target_url = get_url(app=app, url="user.batch_didnumbers")
+    auth.login(dict(email="admin@admin.com" if mode == "upsert" else "non-admin@admin.com", password="123456"))
+    items = [
+        dict(value="+55 84 91234-5000", monthlyPrice="0.5", setupPrice="3.49", currency="U$"),
+        dict(value="+55 84 91234-4320", monthlyPrice="0.5", setupPrice="3.49", currency="U$"),
+        dict(value="+55 84 91234-5001", monthlyPrice="0.5", setupPrice="3.49"),
+        dict(value="+55 84 91234-5000", monthlyPrice="0.5", setupPrice="3.49", currency="U$"),
+    ]
+    response = auth.generic_post(target_url + f"?mode={mode}", items)
+    assert response.status_code == 200
+
+    data = json_of_response(response)
+    assert [result["status"] for result in data["results"]] == ["created", status, "error", "error"]
+    assert data["results"][1]["id"] == 1
+    assert data["created"] == 1
+
+    detail = json_of_response(client.get(get_url(app=app, url="user.didnumber_detail", id=1)))
+    assert detail["monthly_price"] == monthly_price
+
+
+def test_batch_upsert_did_numbers_with_login_non_admin_view(app, auth, client):
+    """
+    Test that a non-admin user cannot update existing DID numbers with an upsert batch
+    """
+
+    target_url = get_url(app=app, url="user.batch_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    items = [dict(value="+55 84 91234-4320", monthlyPrice="99", setupPrice="3.49", currency="U$")]
+    response = auth.generic_post(target_url + "?mode=upsert", items)
+    assert response.status_code == 403
+    assert DidNumber.query.get(1).monthly_price == 0.06
+
+
+def test_batch_did_numbers_invalid_request_view(app, auth, client):
+    """
+    Test batch DID numbers with an invalid body, mode or too many items
+    """
+
+    app.config.update(DIDNUMBERS_BATCH_MAX_ITEMS=1)
+    target_url = get_url(app=app, url="user.batch_didnumbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    assert auth.generic_post(target_url, dict(value="+55 84 91234-5000")).status_code == 400
+    assert auth.generic_post(target_url + "?mode=replace", []).status_code == 400
+    assert auth.generic_post(target_url, [{}, {}]).status_code == 400
+
+
 def test_edit_did_numbers_without_login_view(app, auth, client):
     """
     Test edit DID numbers without login (a redirection should be done)
@@ -199,6 +1058,102 @@ def test_edit_did_number_using_value_that_already_exist_view(app, auth, client):
     assert response.status_code == 400
 
 
+def test_bulk_edit_did_numbers_with_login_non_admin_view(app, auth, client):
+    """
+    Test bulk edit DID numbers with login but with no access permission (non-admin user)
+    """
+
+    target_url = get_url(app=app, url="user.bulk_edit_did_numbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    response = auth.generic_put(target_url, dict(ids=[1], set=dict(currency="EUR")))
+    assert response.status_code == 403
+
+
+def test_bulk_edit_did_numbers_with_login_admin_view(app, auth, client):
+    """
+    Test bulk edit DID numbers with a relative price change and an absolute currency, in several chunks
+    """
+
+    app.config.update(DIDNUMBERS_BULK_CHUNK_SIZE=1)
+    target_url = get_url(app=app, url="user.bulk_edit_did_numbers")
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    a_dict = dict(filter=dict(prefix="+55 84", currency="U$"), set=dict(monthlyPrice="+50%", currency="EUR"))
+    response = auth.generic_put(target_url, a_dict)
+    assert response.status_code == 200
+    assert json_of_response(response)["updated"] == 2
+
+    detail = json_of_response(client.get(get_url(app=app, url="user.didnumber_detail", id=2)))
+    assert detail["monthly_price"] == pytest.approx(0.09)
+    assert detail["currency"] == "EUR"
+    assert DidNumber.query.get(2).version == 2
+
+
+def test_bulk_edit_did_numbers_invalid_request_view(app, auth, client):
+    """
+    Test bulk edit DID numbers without a filter or with an invalid change
+    """
+
+    target_url = get_url(app=app, url="user.bulk_edit_did_numbers")
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    assert auth.generic_put(target_url, dict(filter={}, set=dict(currency="EUR"))).status_code == 400
+    assert auth.generic_put(target_url, dict(ids=[1], set=dict(monthlyPrice="double"))).status_code == 400
+    assert auth.generic_put(target_url, dict(ids=[1], set={})).status_code == 400
+    assert auth.generic_put(target_url, dict(ids=[1], set="monthlyPrice")).status_code == 400
+    assert auth.generic_put(target_url, dict(ids=[1], set=dict(monthlyPrice=-100))).status_code == 400
+    assert auth.generic_put(target_url, dict(ids=[1], set=dict(currency="TOOLONGCUR"))).status_code == 400
+    assert auth.generic_put(target_url, dict(ids=[1], set=dict(currency=None))).status_code == 400
+    assert DidNumber.query.get(1).serialize()["currency"] == "U$"
+
+
+def test_bulk_edit_did_numbers_price_never_negative_view(app, auth, client):
+    """
+    Test that a relative price decrease in a bulk edit stops at zero
+    """
+
+    target_url = get_url(app=app, url="user.bulk_edit_did_numbers")
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    assert auth.generic_put(target_url, dict(ids=[1], set=dict(setupPrice="-5"))).status_code == 200
+    assert auth.generic_put(target_url, dict(ids=[2], set=dict(setupPrice="-150%"))).status_code == 200
+    assert [did_number.setup_price for did_number in DidNumber.query.order_by(DidNumber.id)] == [0.0, 0.0]
+
+
+def test_bulk_delete_did_numbers_with_login_non_admin_view(app, auth, client):
+    """
+    Test bulk delete DID numbers with login but with no access permission (non-admin user)
+    """
+
+    target_url = get_url(app=app, url="user.bulk_delete_did_numbers")
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    response = client.delete(target_url, data=json.dumps(dict(ids=[1])), content_type="application/json")
+    assert response.status_code == 403
+
+
+def test_bulk_delete_did_numbers_with_login_admin_view(app, auth, client):
+    """
+    Test bulk delete DID numbers using an explicit id list
+    """
+
+    target_url = get_url(app=app, url="user.bulk_delete_did_numbers")
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    response = client.delete(target_url, data=json.dumps(dict(ids=[1, 1000])), content_type="application/json")
+    assert response.status_code == 200
+    assert json_of_response(response)["deleted"] == 1
+    assert client.get(get_url(app=app, url="user.didnumber_detail", id=1)).status_code == 404
+
+
+def test_bulk_delete_did_numbers_misspelled_filter_view(app, auth, client):
+    """
+    Test that a bulk delete with an unknown filter key is refused instead of deleting every DID number
+    """
+
+    target_url = get_url(app=app, url="user.bulk_delete_did_numbers")
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    for a_dict in (dict(filter=dict(curency="EUR")), dict(filter="EUR"), dict(filter=dict(curency="EUR", ids=[]))):
+        response = client.delete(target_url, data=json.dumps(a_dict), content_type="application/json")
+        assert response.status_code == 400
+    assert DidNumber.query.count() == 2
+
+
 def test_delete_did_numbers_without_login_view(app, auth, client):
     """
     Test delete DID numbers without login (a redirection should be done)
@@ -1,6 +1,8 @@
 from flask import redirect
 
-from tests.conftest import get_url
+from app import db
+from app.models import Employee
+from tests.conftest import get_url, json_of_response
 
 
 def test_list_employees_without_login_view(app, client):
@@ -38,6 +40,49 @@ def test_list_employees_with_login_admin_view(app, auth, client):
     assert response.status_code == 200
 
 
+def test_list_employees_paginated_view(app, auth, client):
+    """
+    Test that the employees are listed one page at a time
+    """
+
+    target_url = get_url(app=app, url="user.list_employees")
+    auth.login(a_dict=dict(email="admin@admin.com", password="123456"))
+    data = json_of_response(client.get(target_url + "?start=2&limit=1"))
+    assert data["count"] == 2
+    assert [employee["id"] for employee in data["results"]] == [2]
+    assert data["previous"] == target_url + "?start=1&limit=1"
+    assert data["next"] == ""
+
+
+def test_list_employees_search_view(app, auth, client):
+    """
+    Test that the employees can be searched by a prefix of their names or username
+    """
+
+    target_url = get_url(app=app, url="user.list_employees")
+    auth.login(a_dict=dict(email="admin@admin.com", password="123456"))
+    data = json_of_response(client.get(target_url + "?q=non"))
+    assert [employee["email"] for employee in data["results"]] == ["non-admin@admin.com"]
+
+    response = client.get(target_url + "?q=zzz")
+    assert response.status_code == 200
+    data = json_of_response(response)
+    assert (data["count"], data["results"], data["next"]) == (0, [], "")
+    assert client.get(target_url + "?q=zzz&start=2").status_code == 404
+
+
+def test_list_employees_fields_view(app, auth, client):
+    """
+    Test that only the requested fields of the employees are returned
+    """
+
+    target_url = get_url(app=app, url="user.list_employees")
+    auth.login(a_dict=dict(email="admin@admin.com", password="123456"))
+    data = json_of_response(client.get(target_url + "?fields=id,username"))
+    assert data["results"][0] == {"id": 1, "username": "admin"}
+    assert client.get(target_url + "?fields=password_hash").status_code == 400
+
+
 def test_employees_details_without_login_view(app, client):
     """
     Test list employees details without login (a redirection should be done)
@@ -82,3 +127,74 @@ def test_employee_detail_does_not_exist_view(app, auth, client):
     auth.login(a_dict=dict(email="admin@admin.com", password="123456"))
     response = client.get(target_url)
     assert response.status_code == 404
+
+
+def test_suggest_employees_view(app, auth, client):
+    """
+    Test that employees are suggested by a prefix of their names, username or email, and that the suggestions follow
+    the changes of the employees
+    """
+
+    target_url = get_url(app=app, url="user.suggest_employees")
+    auth.login(a_dict=dict(email="admin@admin.com", password="123456"))
+    data = json_of_response(client.get(target_url + "?q=NON"))
+    assert [employee["id"] for employee in data["results"]] == [2]
+    assert len(json_of_response(client.get(target_url + "?q=first&k=1"))["results"]) == 1
+
+    employee = Employee.query.get(2)
+    employee.username = "agent"
+    db.session.commit()
+    assert json_of_response(client.get(target_url + "?q=non"))["results"] == [
+        {
+            "id": 2,
+            "first_name": "First Name",
+            "last_name": employee.last_name,
+            "username": "agent",
+            "email": "non-admin@admin.com",
+        }
+    ]
+    assert json_of_response(client.get(target_url + "?q=agent"))["results"][0]["id"] == 2
+
+    db.session.delete(employee)
+    db.session.commit()
+    assert json_of_response(client.get(target_url + "?q=agent"))["results"] == []
+
+
+def test_suggest_employees_index_full_view(app, auth, client):
+    """
+    Test that employees are suggested from the database when the index cannot hold them all
+    """
+
+    app.config.update(EMPLOYEES_SUGGEST_MAX_KEYS=4)
+    target_url = get_url(app=app, url="user.suggest_employees")
+    auth.login(a_dict=dict(email="admin@admin.com", password="123456"))
+    data = json_of_response(client.get(target_url + "?q=non-admin"))
+    assert [employee["id"] for employee in data["results"]] == [2]
+    assert client.get(target_url).status_code == 400
+
+
+def test_suggest_employees_with_login_non_admin_view(app, auth, client):
+    """
+    Test that employees cannot be suggested to a non-admin user
+    """
+
+    auth.login(a_dict=dict(email="non-admin@admin.com", password="123456"))
+    assert client.get(get_url(app=app, url="user.suggest_employees") + "?q=a").status_code == 403
+
+
+def test_employee_detail_conditional_view(app, auth, client):
+    """
+    Test that an employee detail is not sent again while the employee has not changed
+    """
+
+    target_url = get_url(app=app, url="user.employee_detail", id=2)
+    auth.login(a_dict=dict(email="admin@admin.com", password="123456"))
+    etag = client.get(target_url).headers["ETag"]
+    assert client.get(target_url, headers={"If-None-Match": etag}).status_code == 304
+
+    Employee.query.get(2).last_name = "Other Name"
+    db.session.commit()
+    assert Employee.query.get(2).version == 2
+    assert client.get(target_url, headers={"If-None-Match": etag}).status_code == 200
+    etag = client.get(get_url(app=app, url="user.list_employees")).headers["ETag"]
+    assert client.get(get_url(app=app, url="user.list_employees"), headers={"If-None-Match": etag}).status_code == 304
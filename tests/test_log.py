@@ -0,0 +1,166 @@
+import gzip
+import json
+import logging
+import queue
+import time
+
+from flask import g
+
+from log import (
+    BoundedQueueHandler,
+    JsonFormatter,
+    Log,
+    RateLimitFilter,
+    RequestContextFilter,
+    SizedTimedRotatingFileHandler,
+)
+from tests.conftest import get_url
+
+
+def make_record(msg):
+    return logging.makeLogRecord({"name": "test", "levelno": logging.INFO, "levelname": "INFO", "msg": msg})
+
+
+def test_loggers_share_handlers():
+    """
+    Test that the loggers of the same log file share their handlers
+    """
+
+    first = Log("evolux-project").get_logger(logger_name="test-first")
+    second = Log("evolux-project").get_logger(logger_name="test-second")
+    assert first.handlers == second.handlers
+    assert len(first.handlers) in (1, 2)
+
+
+def test_bounded_queue_handler_drops_records():
+    """
+    Test that the records are dropped when the log queue is full, and that the drops are reported afterwards
+    """
+
+    log_queue = queue.Queue(maxsize=2)
+    handler = BoundedQueueHandler(log_queue)
+    for msg in ("first", "second", "third", "fourth"):
+        handler.handle(make_record(msg))
+    assert handler.dropped == 2
+    assert [log_queue.get_nowait().getMessage() for _ in range(2)] == ["first", "second"]
+
+    handler.handle(make_record("fifth"))
+    assert handler.dropped == 0
+    assert [log_queue.get_nowait().getMessage() for _ in range(2)] == [
+        "fifth",
+        "2 log records dropped because the log queue was full",
+    ]
+
+
+def test_rate_limit_filter_suppresses_similar_records():
+    """
+    Test that the records of a call site are suppressed past the rate limit, and that the suppression is reported
+    """
+
+    rate_limit_filter = RateLimitFilter(limit=2, interval=0.1)
+    assert [rate_limit_filter.filter(make_record("same")) for _ in range(5)] == [True, True, False, False, False]
+
+    other = make_record("other")
+    other.lineno = 1
+    assert rate_limit_filter.filter(other)
+
+    time.sleep(0.1)
+    record = make_record("same")
+    assert rate_limit_filter.filter(record)
+    assert record.getMessage() == "same (3 similar messages suppressed)"
+
+
+def test_set_log_levels():
+    """
+    Test that the level of a logger can be set by its name
+    """
+
+    logger = Log("evolux-project").get_logger(logger_name="test-levels")
+    Log.set_levels({"test-levels": "warning"})
+    assert logger.level == logging.WARNING
+    assert not logger.isEnabledFor(logging.INFO)
+
+
+def test_json_formatter_with_request_fields(app):
+    """
+    Test that a record logged while handling a request is formatted as a JSON line with the request fields
+    """
+
+    with app.test_request_context("/didnumbers"):
+        g.request_id, g.employee_id, g.request_started = "abc", 1, time.perf_counter()
+        record = make_record("Listed %s DID numbers")
+        record.args = (2,)
+        assert RequestContextFilter().filter(record)
+
+    data = json.loads(JsonFormatter().format(record))
+    assert data["message"] == "Listed 2 DID numbers"
+    assert data["level"] == "INFO"
+    assert (data["request_id"], data["route"], data["employee_id"]) == ("abc", "/didnumbers", 1)
+    assert data["elapsed_ms"] >= 0
+
+
+def test_request_correlation_id(app, client):
+    """
+    Test that every response carries the correlation id of its request, given by the client or generated
+    """
+
+    target_url = get_url(app=app, url="auth.login")
+    assert client.get(target_url, headers={"X-Request-ID": "abc"}).headers["X-Request-ID"] == "abc"
+    assert len(client.get(target_url).headers["X-Request-ID"]) == 32
+
+
+def test_rotating_file_handler_compresses_and_prunes(tmp_path):
+    """
+    Test that the log file is rotated by size, and that the rotated files are compressed and pruned by count
+    """
+
+    handler = SizedTimedRotatingFileHandler(str(tmp_path / "test.log"), max_bytes=100, backup_count=2)
+    for i in range(20):
+        handler.handle(make_record(f"message number {i:02}"))
+    handler.close()
+
+    rotated = sorted(path.name for path in tmp_path.iterdir() if path.name not in ("test.log", "test.log.lock"))
+    assert len(rotated) == 2
+    assert all(name.endswith(".gz") for name in rotated)
+    assert (tmp_path / "test.log").read_text().endswith("message number 19\n")
+    with gzip.open(tmp_path / rotated[-1], "rt") as rotated_file:
+        assert "message number" in rotated_file.read()
+
+
+def test_rotating_file_handler_prunes_by_size(tmp_path):
+    """
+    Test that the rotated files are pruned when they take more than the allowed size
+    """
+
+    handler = SizedTimedRotatingFileHandler(
+        str(tmp_path / "test.log"), max_bytes=100, max_total_bytes=150, compress=False
+    )
+    for i in range(20):
+        handler.handle(make_record(f"message number {i:02}"))
+    handler.close()
+
+    rotated = [path for path in tmp_path.iterdir() if path.name not in ("test.log", "test.log.lock")]
+    assert len(rotated) == 1
+    assert rotated[0].stat().st_size <= 150
+
+
+def test_rotating_file_handlers_of_several_processes(tmp_path):
+    """
+    Test that a handler follows the rotations made by the handler of another process on the same file, without losing
+    lines or rotating the file again
+    """
+
+    first = SizedTimedRotatingFileHandler(str(tmp_path / "test.log"), max_bytes=100, compress=False)
+    second = SizedTimedRotatingFileHandler(str(tmp_path / "test.log"), max_bytes=100, compress=False)
+    second.handle(make_record("message of the second handler"))
+    for i in range(4):
+        first.handle(make_record(f"message number {i:02}"))
+    second.handle(make_record("another message of the second handler"))
+    first.close()
+    second.close()
+
+    rotated = [path for path in tmp_path.iterdir() if path.name not in ("test.log", "test.log.lock")]
+    lines = "".join(path.read_text() for path in [*rotated, tmp_path / "test.log"]).splitlines()
+    assert len(lines) == 6
+    assert lines.count("message of the second handler") + lines.count("another message of the second handler") == 2
+    assert (tmp_path / "test.log").read_text().endswith("another message of the second handler\n")
@@ -0,0 +1,35 @@
+from tests.conftest import get_url
+
+
+def test_metrics_with_login_non_admin_view(app, auth, client):
+    """
+    Test that the metrics cannot be read by a non-admin user
+    """
+
+    auth.login(dict(email="non-admin@admin.com", password="123456"))
+    assert client.get(get_url(app=app, url="user.metrics")).status_code == 403
+
+
+def test_metrics_view(app, auth, client):
+    """
+    Test that the request counts, latencies, database times and cache stats are exposed in the Prometheus format
+    """
+
+    auth.login(dict(email="admin@admin.com", password="123456"))
+    client.get(get_url(app=app, url="user.list_didnumbers"))
+    client.get(get_url(app=app, url="user.list_didnumbers"))
+    client.get("/does-not-exist")
+
+    response = client.get(get_url(app=app, url="user.metrics"))
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    lines = response.data.decode().splitlines()
+    assert 'http_requests_total{endpoint="user.list_didnumbers",method="GET",status="200"} 2' in lines
+    assert 'http_requests_total{endpoint="unmatched",method="GET",status="404"} 1' in lines
+    assert 'http_request_duration_seconds_count{endpoint="user.list_didnumbers"} 2' in lines
+    assert 'http_request_duration_seconds_bucket{endpoint="user.list_didnumbers",le="+Inf"} 2' in lines
+    db_time = next(
+        line for line in lines if line.startswith('http_request_db_duration_seconds_sum{endpoint="user.list')
+    )
+    assert float(db_time.split()[-1]) > 0
+    assert 'cache_hits_total{cache="responses"} 1' in lines
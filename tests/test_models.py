@@ -1,4 +1,5 @@
-from app.models import Employee, DidNumber
+from app import db
+from app.models import Employee, DidNumber, DidNumberCount
 
 
 def test_employee_model(app):
@@ -15,3 +16,46 @@ def test_did_number_model(app):
     """
 
     assert DidNumber.query.count() == 2
+
+
+def test_did_number_count_model(app):
+    """
+    Test that the DID numbers counters follow the ORM writes and can be rebuilt
+    """
+
+    assert DidNumberCount.get_total() == 2
+    assert DidNumberCount.get_total("U$") == 2
+
+    did_number = DidNumber.query.get(1)
+    did_number.currency = "EUR"
+    db.session.delete(DidNumber.query.get(2))
+    db.session.commit()
+    assert DidNumberCount.get_total() == 1
+    assert DidNumberCount.get_total("U$") == 0
+    assert DidNumberCount.get_total("EUR") == 1
+
+    db.session.query(DidNumberCount).delete()
+    db.session.commit()
+    DidNumberCount.rebuild()
+    assert DidNumberCount.get_total("EUR") == 1
+
+
+def test_did_number_count_added_concurrently(app, monkeypatch):
+    """
+    Test that the counter of a new currency is updated when another transaction inserted it after it was not found
+    """
+
+    db.session.execute(DidNumberCount.__table__.insert().values(currency="EUR", total=1))
+    execute, missed = db.session.execute, []
+
+    def execute_missing_the_counter(statement, *args, **kwargs):
+        if not missed:
+            missed.append(statement)
+            return type("Result", (), {"rowcount": 0})()
+        return execute(statement, *args, **kwargs)
+
+    monkeypatch.setattr(db.session, "execute", execute_missing_the_counter)
+    DidNumberCount.adjust({"EUR": 2})
+    monkeypatch.undo()
+    db.session.commit()
+    assert DidNumberCount.get_total("EUR") == 3